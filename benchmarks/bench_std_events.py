@@ -0,0 +1,97 @@
+'''benchmark of toggl.std_events_from_entries against the row-wise
+transform it replaced, on generated time entries
+
+    python benchmarks/bench_std_events.py [entries]
+'''
+# -----------------------------------------------------
+# Import
+# -----------------------------------------------------
+import sys
+import time
+import numpy as np
+import pandas as pd
+import datetime as dt
+
+from nthours import toggl
+
+# -----------------------------------------------------
+# Module variables
+# -----------------------------------------------------
+ENTRIES = 100000
+PROJECTS = 50
+CLIENTS = 10
+COMPARE_FIELDS = ['timestamp', 'date', 'time', 'duration_hrs', 'activity', 'comment']
+
+# -----------------------------------------------------
+# Benchmark
+# -----------------------------------------------------
+
+
+def workspace(entry_count):
+    # back to back entries of 10 minutes to 3 hours, some crossing midnight, half with a tag
+    rng = np.random.default_rng(0)
+    clients = [{'id': c, 'name': 'client%d' % c} for c in range(CLIENTS)]
+    projects = [{'id': 100 + p, 'name': 'project%d' % p, 'client_id': p % CLIENTS}
+                for p in range(PROJECTS)]
+    durations = rng.integers(600, 3 * 3600, entry_count)
+    starts = dt.datetime(2015, 1, 1) + pd.to_timedelta(np.cumsum(durations) - durations, unit='s')
+    entries = []
+    for i in range(entry_count):
+        entries.append({
+            'id': i,
+            'project_id': 100 + int(rng.integers(PROJECTS)),
+            'description': 'entry %d' % i,
+            'tags': ['tag%d' % (i % 5)] if i % 2 else [],
+            'start': starts[i].strftime(toggl.TOGGL_TIMESTAMP_FORMAT),
+            'duration': int(durations[i])})
+    return entries, projects, clients
+
+
+def rowwise_std_events(entries, projects, clients):
+    # std_events_from_entries before the rewrite, with the current split at midnight
+    std = pd.DataFrame.from_records(entries)
+
+    activity_labels = []
+    for p in projects:
+        client = [c['name'] for c in clients if c['id'] == p['client_id']][0]
+        activity_labels.append({'id': p['id'], 'activity': client + toggl.ACTIVITY_DELIM + p['name']})
+    activities = pd.DataFrame.from_records(activity_labels)
+    std = std.merge(activities, left_on='project_id', right_on='id', how='left')
+
+    std['description'] = std['description'].fillna('')
+    std['comment'] = std.apply(lambda x: x['tags'][0] + toggl.TAG_DELIM + x['description']
+        if x['tags'] else x['description'], axis=1)
+    std['timestamp'] = std['start'].apply(lambda x: toggl.utc_str_to_local_datetime(x, 'start'))
+
+    std = toggl.split_overlap_events(std, method='api_entries')
+
+    std['date'] = std['timestamp'].apply(lambda x: x.date())
+    std['time'] = std['timestamp'].apply(lambda x: x.time())
+    std['duration_hrs'] = std['duration'] / toggl.SEC_PER_HOUR
+    return std[COMPARE_FIELDS]
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(entry_count=ENTRIES):
+    toggl.tz_local = toggl.pytz.timezone('Asia/Singapore')
+    entries, projects, clients = workspace(entry_count)
+
+    columnar, columnar_sec = timed(toggl.std_events_from_entries,
+                                   entries, projects, clients, full_days_only=False)
+    print('columnar  %8d entries %8.3f s' % (entry_count, columnar_sec))
+
+    rowwise, rowwise_sec = timed(rowwise_std_events, entries, projects, clients)
+    print('row-wise  %8d entries %8.3f s' % (entry_count, rowwise_sec))
+    print('speedup %.0fx' % (rowwise_sec / columnar_sec))
+
+    pd.testing.assert_frame_equal(columnar[COMPARE_FIELDS].reset_index(drop=True),
+                                  rowwise.reset_index(drop=True), check_dtype=False)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else ENTRIES)
@@ -0,0 +1,68 @@
+'''benchmark of the calendar fields of TimeSeriesTable.addFields_ymwk
+against the row-wise apply of get_weekNumber it replaced
+
+    python benchmarks/bench_week_numbers.py [rows]
+'''
+# -----------------------------------------------------
+# Import
+# -----------------------------------------------------
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from nthours import time_series
+from nthours.time_series import TimeSeriesTable
+
+# -----------------------------------------------------
+# Module variables
+# -----------------------------------------------------
+ROWS = 1000000
+YEARS = 10
+
+# -----------------------------------------------------
+# Benchmark
+# -----------------------------------------------------
+
+
+def events(rows):
+    # sorted start timestamps over YEARS years, about rows / (YEARS * 365) per day
+    rng = np.random.default_rng(0)
+    seconds = np.sort(rng.integers(0, YEARS * 365 * 86400, rows))
+    timestamps = pd.Timestamp('2015-01-01') + pd.to_timedelta(seconds, unit='s')
+    return pd.DataFrame({'timestamp': timestamps, 'duration_hrs': 0.5})
+
+
+def rowwise_addFields(table, data):
+    # addFields_ymwk before the calendar join
+    data['year'] = data.apply(lambda x: x[table.dtField].year, axis=1)
+    data['month'] = data.apply(lambda x: x[table.dtField].month, axis=1)
+    data['week'] = data.apply(lambda x: table.get_weekNumber(x[table.dtField]), axis=1)
+    data['DOW'] = data.apply(lambda x: x[table.dtField].weekday(), axis=1)
+    return data
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(rows=ROWS):
+    data = events(rows)
+    table = TimeSeriesTable(None, dtField='timestamp')
+
+    time_series.calendar = None
+    joined, joined_sec = timed(table.addFields_ymwk, data.copy())
+    print('calendar join  %9d rows %8.3f s' % (rows, joined_sec))
+
+    rowwise, rowwise_sec = timed(rowwise_addFields, table, data.copy())
+    print('row-wise apply %9d rows %8.3f s' % (rows, rowwise_sec))
+    print('speedup %.0fx' % (rowwise_sec / joined_sec))
+
+    for f in ['year', 'month', 'week', 'DOW']:
+        assert (joined[f].astype('int64').values == rowwise[f].astype('int64').values).all(), f
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
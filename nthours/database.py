@@ -4,17 +4,21 @@
 # Import
 # -----------------------------------------------------
 import os
+import re
 import shutil
+from contextlib import contextmanager
 #import utilities.fso as fso
 import json
 import pandas as pd
 import datetime as dt
 import pymysql
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, select, MetaData, Table, Column, Index
+from sqlalchemy import DateTime, Date, Time, String, Text, Float, Integer, BigInteger
 from sqlalchemy.engine.reflection import Inspector
 from nthours.gsheet import api as gs
 from nthours.gsheet import gdrive
 from nthours import mysql
+from nthours import instrument
 
 ##-----------------------------------------------------
 # Module variables
@@ -23,6 +27,18 @@ from nthours import mysql
 NUMERIC_TYPES = ['int', 'float']
 SQL_DB_NAME = 'sqlite:///hours.db'
 DB_SOURCE = 'local'    #to use local sqlite, change to 'local'
+SYNC_TABLE = 'sync_state'
+UPSERT_BATCH_ROWS = 500
+READ_CHUNK_ROWS = 50000
+GSHEET_SNAPSHOT_PREFIX = 'gsheet_'
+A1_RANGE = re.compile(r'^(?P<sheet>.+)!(?P<col0>[A-Z]+)(?P<row0>[0-9]+):(?P<col1>[A-Z]+)[0-9]*$')
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',      # readers do not block the writer
+    'PRAGMA synchronous=NORMAL',    # safe with WAL, fsync at checkpoints only
+    'PRAGMA cache_size=-65536',     # 64 MB page cache
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000']
+MIGRATION_SUFFIX = '_unmanaged'
 
 # dynamic : config
 CONFIG = {}
@@ -53,10 +69,12 @@ def load_gsheet():
     global gs_engine
     if gs_engine is None:
         gs_engine = gs.SheetsEngine()
+        instrument.count(api_calls=1)
 
 
 def load_gdrive():
     gdrive.login()
+    instrument.count(api_calls=1)
 
 
 # -----------------------------------------------------
@@ -71,31 +89,376 @@ def load_sql():
             engine = mysql.engine
         elif DB_SOURCE == 'local':
             engine = create_engine(SQL_DB_NAME, echo=False)
+            event.listen(engine, 'connect', set_sqlite_pragmas)
+            event.listen(engine, 'begin', begin_sqlite)
         else:
             raise ValueError('unknown database source %s' % DB_SOURCE)
         inspector = Inspector.from_engine(engine)
         table_names = inspector.get_table_names()
+        migrate_tables()
+
+
+def set_sqlite_pragmas(dbapi_con, con_record):
+    # the driver does not begin transactions itself, begin_sqlite does
+    dbapi_con.isolation_level = None
+    cursor = dbapi_con.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def begin_sqlite(con):
+    # an explicit BEGIN, so that create and drop statements are part of the transaction
+    # IMMEDIATE takes the write lock up front, waiting up to busy_timeout for another
+    # writer, in WAL mode a deferred transaction that reads and then writes fails at once
+    con.execute('BEGIN IMMEDIATE')
+
+
+def transaction():
+    """ context manager of a connection in one transaction, for the con argument
+    of update_table and upsert_table
+    """
+    return in_transaction()
+
+
+def event_schema(metadata):
+    return Table(
+        'event', metadata,
+        Column('timestamp', DateTime, primary_key=True),
+        Column('date', Date),
+        Column('time', Time),
+        Column('activity', String(255)),
+        Column('duration_hrs', Float),
+        Column('year', Integer),
+        Column('month', Integer),
+        Column('week', Integer),
+        Column('DOW', Integer),
+        Column('comment', Text),
+        Column('entry_id', BigInteger),
+        Index('ix_event_date', 'date'),
+        Index('ix_event_activity', 'activity'),
+        Index('ix_event_entry_id', 'entry_id'))
+
+
+def staging_schema(metadata):
+    return Table(
+        'event_staging', metadata,
+        Column('timestamp', DateTime, primary_key=True),
+        Column('duration_hrs', Float),
+        Column('activity', String(255)),
+        Column('comment', Text),
+        Column('entry_id', BigInteger))
+
+
+# tables created from a schema, with keys and indexes, instead of by to_sql
+MANAGED_TABLES = {'event': event_schema, 'event_staging': staging_schema}
+
+
+def create_table(tblname, con):
+    table = MANAGED_TABLES[tblname](MetaData())
+    table.create(con)
+    if not table_exists(tblname):
+        table_names.append(tblname)
+    return table
+
+
+def migrate_tables():
+    """ moves the rows of managed tables that were created by to_sql, without
+    a primary key, into a table created from the schema. the last row of a key wins
+    managed tables with a primary key get the schema columns and indexes they lack
+    """
+    for tblname in MANAGED_TABLES:
+        if table_exists(tblname) and inspector.get_pk_constraint(tblname)['constrained_columns']:
+            add_missing_columns(tblname)
+            if DB_SOURCE == 'local':
+                repair_dates(tblname)
+        elif table_exists(tblname):
+            old_name = tblname + MIGRATION_SUFFIX
+            with engine.begin() as con:
+                con.execute('ALTER TABLE %s RENAME TO %s' % (tblname, old_name))
+                table = create_table(tblname, con)
+                key = table.primary_key.columns.keys()[0]
+                rows = pd.read_sql_table(old_name, con=con)
+                rows = rows[~rows[key].duplicated(keep='last')]
+                rows = rows[[c for c in table.columns.keys() if c in rows.columns]]
+                rows = as_schema_types(rows, tblname)
+                rows.to_sql(tblname, con=con, if_exists='append', index=False)
+                con.execute('DROP TABLE %s' % old_name)
+            instrument.count(rows=len(rows))
+
+
+def add_missing_columns(tblname):
+    """ adds the columns and indexes of the schema that the stored table lacks,
+    the new columns are empty in the stored rows
+    """
+    table = MANAGED_TABLES[tblname](MetaData())
+    columns = [c['name'] for c in inspector.get_columns(tblname)]
+    indexes = [i['name'] for i in inspector.get_indexes(tblname)]
+    with engine.begin() as con:
+        for column in table.columns:
+            if not column.name in columns:
+                con.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    tblname, column.name, column.type.compile(dialect=engine.dialect)))
+        for index in table.indexes:
+            if not index.name in indexes:
+                index.create(con)
+
+
+def repair_dates(tblname):
+    """ cuts the date columns of a sqlite table written as timestamp strings,
+    'YYYY-MM-DD 00:00:00.000000', back to 'YYYY-MM-DD'
+    """
+    table = MANAGED_TABLES[tblname](MetaData())
+    with engine.begin() as con:
+        for column in table.columns:
+            if type(column.type) is Date:
+                con.execute('UPDATE %s SET %s = substr(%s, 1, 10) WHERE length(%s) > 10' % (
+                    tblname, column.name, column.name, column.name))
+
+
+def as_schema_types(tbl, tblname):
+    """ tbl with its datetime64 columns converted to the date or time values of the
+    Date and Time columns of the managed table tblname. to_sql writes datetime64
+    values as timestamps whatever the type of the stored column
+    """
+    table = MANAGED_TABLES[tblname](MetaData())
+    converted = {}
+    for column in table.columns:
+        if column.name in tbl.columns and pd.api.types.is_datetime64_any_dtype(tbl[column.name]):
+            if type(column.type) is Date:
+                converted[column.name] = tbl[column.name].dt.date
+            elif type(column.type) is Time:
+                converted[column.name] = tbl[column.name].dt.time
+    if len(converted) > 0:
+        tbl = tbl.assign(**converted)
+    return tbl
 
 
 def table_exists(tableName):
     return tableName in table_names
 
 
-def get_table(tableName):
+def get_table(tableName, columns=None, date_from=None, date_to=None,
+              activity=None, date_column='date'):
+    """ reads the table, or only the rows and columns matching the filters
+    date_from and date_to are inclusive bounds on date_column, activity is a label or a list
+    """
     if table_exists(tableName):
-        tbl = pd.read_sql_table(tableName, con=engine)
+        if columns is None and date_from is None and date_to is None and activity is None:
+            tbl = pd.read_sql_table(tableName, con=engine)
+        else:
+            qry, parse_dates = table_query(tableName, columns, date_from, date_to, activity, date_column)
+            tbl = pd.read_sql(qry, con=engine, parse_dates=parse_dates)
+        instrument.count(rows=len(tbl))
     else:
         tbl = None
     return tbl
 
 
-def update_table(tbl, tblname, append=True):
-    global engine
-    if append:
-        ifex = 'append'
+def table_query(tableName, columns=None, date_from=None, date_to=None,
+                activity=None, date_column='date', order_by=None):
+    """ select statement with the filters of get_table as a sql WHERE,
+    and the date columns to parse as read_sql_table does
+    """
+    table = Table(tableName, MetaData(), autoload=True, autoload_with=engine)
+    if columns is None:
+        cols = list(table.columns)
+    else:
+        cols = [table.c[c] for c in columns]
+    qry = select(cols)
+    if not date_from is None:
+        qry = qry.where(table.c[date_column] >= sql_date(date_from, table.c[date_column]))
+    if not date_to is None:
+        # the day after date_to as an exclusive bound, so that datetime values and
+        # stored timestamp strings on date_to are included
+        day_after = pd.Timestamp(date_to).normalize() + dt.timedelta(days=1)
+        qry = qry.where(table.c[date_column] < sql_date(day_after, table.c[date_column]))
+    if not activity is None:
+        if isinstance(activity, str):
+            activity = [activity]
+        qry = qry.where(table.c['activity'].in_(activity))
+    if not order_by is None:
+        qry = qry.order_by(table.c[order_by])
+    parse_dates = [c.name for c in cols if isinstance(c.type, (Date, DateTime))]
+    return qry, parse_dates
+
+
+def iter_table(tableName, chunksize=READ_CHUNK_ROWS, columns=None, date_from=None,
+               date_to=None, activity=None, date_column='date', order_by=None):
+    """ yields the rows matching the filters of get_table as DataFrames of chunksize rows
+    the result is streamed, with a server-side cursor on mysql
+    """
+    if table_exists(tableName):
+        qry, parse_dates = table_query(
+            tableName, columns, date_from, date_to, activity, date_column, order_by)
+        with engine.connect() as con:
+            con = con.execution_options(stream_results=True)
+            for chunk in pd.read_sql(qry, con=con, parse_dates=parse_dates, chunksize=chunksize):
+                instrument.count(rows=len(chunk))
+                yield chunk
+
+
+def iter_rows(tableName, chunksize=READ_CHUNK_ROWS, columns=None, date_from=None,
+              date_to=None, activity=None, date_column='date', order_by=None):
+    """ yields the rows matching the filters of get_table as lists of up to chunksize tuples
+    """
+    if table_exists(tableName):
+        qry, parse_dates = table_query(
+            tableName, columns, date_from, date_to, activity, date_column, order_by)
+        with engine.connect() as con:
+            result = con.execution_options(stream_results=True).execute(qry)
+            rows = result.fetchmany(chunksize)
+            while len(rows) > 0:
+                instrument.count(rows=len(rows))
+                yield [tuple(r) for r in rows]
+                rows = result.fetchmany(chunksize)
+
+
+def sql_date(value, column):
+    # date and datetime columns bind only python date and datetime values
+    value = pd.Timestamp(value)
+    if isinstance(column.type, DateTime):
+        return value.to_pydatetime()
+    elif isinstance(column.type, Date):
+        return value.date()
+    return str(value.date())
+
+
+def get_max(tableName, column):
+    value = None
+    if table_exists(tableName):
+        qry = 'SELECT MAX(%s) AS %s FROM %s' % (column, column, tableName)
+        value = pd.read_sql(qry, con=engine)[column].iloc[0]
+    return value
+
+
+def get_columns(tableName):
+    columns = []
+    if table_exists(tableName):
+        columns = Table(tableName, MetaData(), autoload=True, autoload_with=engine).columns.keys()
+    return columns
+
+
+def get_distinct(tableName, column):
+    values = []
+    if table_exists(tableName):
+        qry = 'SELECT DISTINCT %s FROM %s' % (column, tableName)
+        values = pd.read_sql(qry, con=engine)[column].to_list()
+        instrument.count(rows=len(values))
+    return values
+
+
+def update_table(tbl, tblname, append=True, con=None):
+    """ appends tbl, or replaces the rows of the table when append is False.
+    managed tables keep their schema, replace deletes their rows instead of dropping them
+    con is a connection from transaction() to write as part of a larger transaction
+    """
+    with in_transaction(con) as con:
+        if tblname in MANAGED_TABLES:
+            if not table_exists(tblname):
+                create_table(tblname, con)
+            elif not append:
+                con.execute(Table(tblname, MetaData(), autoload=True, autoload_with=con).delete())
+            tbl = as_schema_types(tbl, tblname)
+            tbl.to_sql(tblname, con=con, if_exists='append', index=False)
+        else:
+            if append:
+                ifex = 'append'
+            else:
+                ifex = 'replace'
+            tbl.to_sql(tblname, con=con, if_exists=ifex, index=False)
+    instrument.count(rows=len(tbl))
+    if not table_exists(tblname):
+        table_names.append(tblname)
+
+
+def upsert_table(tbl, tblname, key='timestamp', con=None):
+    """ inserts the rows of tbl, replacing the stored rows with the same key,
+    in one transaction that touches only the incoming keys
+    on mysql, tables with key as primary key are written by mysql.upsert_table
+    con is a connection from transaction() to write as part of a larger transaction
+    """
+    if not table_exists(tblname):
+        update_table(tbl, tblname, con=con)
+    else:
+        if tblname in MANAGED_TABLES:
+            tbl = as_schema_types(tbl, tblname)
+        with in_transaction(con) as con:
+            table = Table(tblname, MetaData(), autoload=True, autoload_with=con)
+            if DB_SOURCE == 'remote' and table.primary_key.columns.keys() == [key]:
+                # mysql replaces the rows with the same key in the insert itself
+                mysql.upsert_table(tbl, table, con)
+            else:
+                keys = tbl[key].to_list()
+                for i in range(0, len(keys), UPSERT_BATCH_ROWS):
+                    batch = keys[i:i + UPSERT_BATCH_ROWS]
+                    con.execute(table.delete().where(table.c[key].in_(batch)))
+                tbl.to_sql(tblname, con=con, if_exists='append', index=False)
+        instrument.count(rows=len(tbl))
+
+
+def get_rows(tableName, column, values, columns=None):
+    """ reads the rows of tableName whose column is in values, in batches
+    """
+    tbl = None
+    if table_exists(tableName) and len(values) > 0:
+        table = Table(tableName, MetaData(), autoload=True, autoload_with=engine)
+        cols = list(table.columns) if columns is None else [table.c[c] for c in columns]
+        parse_dates = [c.name for c in cols if isinstance(c.type, (Date, DateTime))]
+        chunks = []
+        for i in range(0, len(values), UPSERT_BATCH_ROWS):
+            batch = select(cols).where(table.c[column].in_(values[i:i + UPSERT_BATCH_ROWS]))
+            chunks.append(pd.read_sql(batch, con=engine, parse_dates=parse_dates))
+        tbl = pd.concat(chunks)
+        instrument.count(rows=len(tbl))
+    return tbl
+
+
+def delete_rows(tblname, column, values, con=None):
+    """ deletes the rows of tblname whose column is in values, in batches
+    con is a connection from transaction() to delete as part of a larger transaction
+    """
+    if not table_exists(tblname) or len(values) == 0:
+        return
+    with in_transaction(con) as con:
+        table = Table(tblname, MetaData(), autoload=True, autoload_with=con)
+        for i in range(0, len(values), UPSERT_BATCH_ROWS):
+            batch = values[i:i + UPSERT_BATCH_ROWS]
+            con.execute(table.delete().where(table.c[column].in_(batch)))
+
+
+@contextmanager
+def in_transaction(con=None):
+    # the given connection, or a new one in its own transaction
+    if con is None:
+        try:
+            with engine.begin() as con:
+                yield con
+        except:
+            # tables created in the transaction were rolled back with it
+            table_names[:] = Inspector.from_engine(engine).get_table_names()
+            raise
     else:
-        ifex = 'replace'
-    tbl.to_sql(tblname, con=engine, if_exists=ifex, index=False)
+        yield con
+
+
+def get_sync_value(key):
+    value = None
+    sync_state = get_table(SYNC_TABLE)
+    if not sync_state is None:
+        match = sync_state[sync_state['key'] == key]
+        if len(match) > 0:
+            value = match['value'].iloc[0]
+    return value
+
+
+def set_sync_value(key, value):
+    sync_state = get_table(SYNC_TABLE)
+    if sync_state is None:
+        sync_state = pd.DataFrame(columns=['key', 'value'])
+    sync_state = sync_state[sync_state['key'] != key]
+    sync_state = pd.concat([sync_state, pd.DataFrame({'key': [key], 'value': [str(value)]})])
+    update_table(sync_state, SYNC_TABLE, False)
 
 
 # -----------------------------------------------------
@@ -109,6 +472,7 @@ def get_sheet(rng_code):
     hdrid = rng_config['header']
     valueList = gs_engine.get_rangevalues(wkbid, rngid)
     header = gs_engine.get_rangevalues(wkbid, hdrid)[0]
+    instrument.count(rows=len(valueList), bytes=payload_bytes(valueList), api_calls=2)
     rng = pd.DataFrame(valueList, columns=header)
     if 'data_types' in rng_config:
         data_types = rng_config['data_types']
@@ -145,6 +509,76 @@ def post_to_gsheet(df, rng_code, input_option='RAW'):
     else:
         values = df.values.tolist()
     gs_engine.set_rangevalues(wkbid, rngid, values, input_option)
+    instrument.count(rows=len(values), bytes=payload_bytes(values), api_calls=2)
+
+
+def post_to_gsheet_diff(df, rng_code, input_option='RAW', keys=None, full=False):
+    """ writes only the rows of df that differ from the local snapshot of the sheet
+    keys are the ascending row keys of df, used to detect rows that aged out at the top
+    falls back to a full post when there is no snapshot, the range is not in A1 notation,
+    or rows aged out, which shifts every remaining row up
+    """
+    wkbid = GSHEET_CONFIG['wkbid']
+    rngid = GSHEET_CONFIG[rng_code]['data']
+    snapshot_name = GSHEET_SNAPSHOT_PREFIX + rng_code
+    rng = A1_RANGE.match(rngid)
+    rows = df.reset_index(drop=True)
+    rows_str = rows.astype('str')
+    keys = pd.Series(keys if not keys is None else rows.index).reset_index(drop=True)
+
+    snapshot = None if full else get_table(snapshot_name)
+    is_diffable = not (rng is None or snapshot is None or len(snapshot) == 0 or len(rows) == 0)
+    if is_diffable:
+        # rows aged out at the top shift every remaining row up
+        is_diffable = set(rows_str.columns).issubset(snapshot.columns) \
+            and not (snapshot['key'] < keys.iloc[0]).any()
+
+    if not is_diffable:
+        post_to_gsheet(df, rng_code, input_option)
+    else:
+        # 01 rows that changed or were appended since the snapshot
+        snapshot_str = snapshot[rows_str.columns].astype('str')
+        n_common = min(len(snapshot_str), len(rows_str))
+        changed = (rows_str.iloc[:n_common].values != snapshot_str.iloc[:n_common].values).any(axis=1)
+        is_changed = list(changed) + [True] * (len(rows_str) - n_common)
+
+        # 02 contiguous blocks of changed rows, written in one request
+        if input_option == 'RAW':
+            values = rows_str.values.tolist()
+        else:
+            values = rows.values.tolist()
+        row0 = int(rng.group('row0'))
+        range_values = []
+        start = None
+        for i, flag in enumerate(is_changed + [False]):
+            if flag and start is None:
+                start = i
+            elif not flag and not start is None:
+                range_values.append((row_range(rng, row0 + start, row0 + i - 1), values[start:i]))
+                start = None
+        if len(range_values) > 0:
+            gs_engine.set_rangesvalues(wkbid, range_values, input_option)
+            instrument.count(rows=sum([len(v) for r, v in range_values]),
+                             bytes=payload_bytes(range_values), api_calls=1)
+
+        # 03 clear rows that are no longer in df
+        if len(snapshot_str) > len(rows_str):
+            gs_engine.clear_rangesvalues(wkbid, [
+                row_range(rng, row0 + len(rows_str), row0 + len(snapshot_str) - 1)])
+            instrument.count(api_calls=1)
+
+    snapshot = rows_str.copy()
+    snapshot['key'] = keys
+    update_table(snapshot, snapshot_name, False)
+
+
+def payload_bytes(values):
+    return len(json.dumps(values, default=str))
+
+
+def row_range(rng, first_row, last_row):
+    return '%s!%s%d:%s%d' % (rng.group('sheet'), rng.group('col0'), first_row,
+                             rng.group('col1'), last_row)
 
 
 # -----------------------------------------------------
@@ -57,6 +57,18 @@ class SheetsEngine():
         self.service.spreadsheets().values().update(
             spreadsheetId=spreadsheetId, valueInputOption= input_option, range=rangeName,body=body).execute()
 
+    def set_rangesvalues(self,spreadsheetId,rangeValues,input_option='RAW'):
+        #rangeValues is a list of (rangeName,values) pairs written in a single request
+        body = {'valueInputOption':input_option,
+                'data':[{'range':rangeName,'values':values} for rangeName,values in rangeValues]}
+        self.service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheetId,body=body).execute()
+
+    def clear_rangesvalues(self,spreadsheetId,rangeNames):
+        body = {'ranges':rangeNames}
+        self.service.spreadsheets().values().batchClear(
+            spreadsheetId=spreadsheetId,body=body).execute()
+
     def clear_rangevalues(self,spreadsheetId,rangeName):
         self.service.spreadsheets().values().clear(
             spreadsheetId=spreadsheetId, range=rangeName).execute()
@@ -20,6 +20,7 @@ from googleapiclient.http import MediaIoBaseDownload
 #import httplib2
 import pandas as pd
 import numpy as np
+from nthours import instrument
 
 #-----------------------------------------------------------------------------
 # module variables
@@ -47,6 +48,7 @@ def download_file(file_id):
         #print(F'Download {int(status.progress() * 100)}.')
 
     payload = file.getvalue()
+    instrument.count(bytes=len(payload), api_calls=1)
     return payload
 
 
@@ -75,6 +77,7 @@ def get_folder_id(folder_name):
         q=qry,
         spaces='drive'
     ).execute()
+    instrument.count(api_calls=1)
     found_folder = len(response['files']) > 0
     if found_folder:
         folder_id = response['files'][0]['id']
@@ -97,6 +100,7 @@ def get_files_in_folder(folder_name, folder_id='',
             q=qry,
             spaces='drive'
         ).execute()
+        instrument.count(api_calls=1)
         files = response['files']
     return files
 
@@ -116,6 +120,7 @@ def move_file_to_folder(file_id,
         addParents=destination_id,
         fields='id, parents'
         ).execute()
+    instrument.count(api_calls=1)
 
 
 def move_files_to_folder(file_ids, destination_id, source_id=''):
@@ -129,6 +134,7 @@ def get_file_parent_folder_ids(file_id):
         fileId=file_id,
         fields='parents'
     ).execute()
+    instrument.count(api_calls=1)
     if 'parents' in response:
         parent_ids = response['parents']
     return parent_ids
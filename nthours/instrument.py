@@ -0,0 +1,110 @@
+'''per-stage instrumentation of the update pipeline
+wall time, row counts, bytes transferred and api calls
+'''
+# -----------------------------------------------------
+# Import
+# -----------------------------------------------------
+import json
+import time
+import threading
+import datetime as dt
+
+# -----------------------------------------------------
+# Module variables
+# -----------------------------------------------------
+# constants
+JSONL_FILE = ''    # path to append one json record per stage, '' to disable
+COUNTERS = ['rows', 'bytes', 'api_calls']
+
+# dynamic
+records = []
+hooks = []
+_local = threading.local()
+_lock = threading.Lock()
+
+# -----------------------------------------------------
+# Stages
+# -----------------------------------------------------
+
+
+class Stage():
+    def __init__(self, name):
+        self.record = {'stage': name}
+
+    def __enter__(self):
+        self.record['started_at'] = dt.datetime.now().isoformat()
+        for c in COUNTERS:
+            self.record[c] = 0
+        self.parent = current_stage()
+        _local.stage = self
+        self.start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record['wall_sec'] = time.perf_counter() - self.start
+        self.record['failed'] = not exc_type is None
+        _local.stage = self.parent
+        finish(self.record)
+        return False
+
+
+def stage(name):
+    '''context manager that records one pipeline stage
+    '''
+    return Stage(name)
+
+
+def current_stage():
+    return getattr(_local, 'stage', None)
+
+
+def count(rows=0, bytes=0, api_calls=0):
+    '''adds to the counters of the current stage and its enclosing stages
+    '''
+    s = current_stage()
+    with _lock:
+        while not s is None:
+            s.record['rows'] += rows
+            s.record['bytes'] += bytes
+            s.record['api_calls'] += api_calls
+            s = s.parent
+
+
+def in_stage(func):
+    '''wraps func to count into the calling thread's stage when run on a worker thread
+    '''
+    s = current_stage()
+
+    def wrapper(*args, **kwargs):
+        previous = current_stage()
+        _local.stage = s
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.stage = previous
+    return wrapper
+
+
+def finish(record):
+    with _lock:
+        records.append(record)
+        if JSONL_FILE:
+            with open(JSONL_FILE, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+    for hook in hooks:
+        hook(record)
+
+
+def add_hook(func):
+    '''func(record) is called with each finished stage record
+    '''
+    hooks.append(func)
+
+
+def reset():
+    global records
+    records = []
+
+# -----------------------------------------------------
+# ***
+# -----------------------------------------------------
@@ -3,19 +3,28 @@
 # -----------------------------------------------------
 # Import
 # -----------------------------------------------------
+import os
 import json
+import tempfile
 import pymysql
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text, Integer
+from sqlalchemy.dialects.mysql import insert
 
 ##-----------------------------------------------------
 # Module variables
 ##-----------------------------------------------------
+# constants
+POOL_SIZE = 5
+MAX_OVERFLOW = 5
+POOL_RECYCLE_SEC = 3600        # below the server wait_timeout, so idle connections are renewed
+INSERT_BATCH_ROWS = 1000       # rows per multi-row INSERT
+LOAD_DATA_MIN_ROWS = 50000     # from this many rows, upserts go through LOAD DATA LOCAL INFILE
+LOCAL_INFILE = False           # a server may then read any local file the client can, so it is opt-in
 
 MYSQL_CONFIG = {}
 MYSQL_DB_NAME = 'hours'
 MYSQL_CREDENTIALS = {}
 engine = None
-con = None
 
 # -----------------------------------------------------
 # Setup
@@ -31,11 +40,82 @@ def load_config():
 
 
 def load_sql():
-    global engine, con
+    global engine
     if engine is None:
+        connect_args = {'local_infile': True} if local_infile() else {}
         engine = create_engine(
             MYSQL_CREDENTIALS['login'].format(
                 user=MYSQL_CREDENTIALS['username'],
                 pw=MYSQL_CREDENTIALS['password'],
-                db=MYSQL_CREDENTIALS['database']))
-        con = engine.connect()
\ No newline at end of file
+                db=MYSQL_CREDENTIALS['database']),
+            pool_size=MYSQL_CREDENTIALS.get('pool_size', POOL_SIZE),
+            max_overflow=MYSQL_CREDENTIALS.get('max_overflow', MAX_OVERFLOW),
+            pool_recycle=MYSQL_CREDENTIALS.get('pool_recycle', POOL_RECYCLE_SEC),
+            pool_pre_ping=True,
+            connect_args=connect_args)
+
+
+def local_infile():
+    # LOAD DATA LOCAL INFILE is allowed only with "local_infile": true in the credentials
+    return MYSQL_CREDENTIALS.get('local_infile', LOCAL_INFILE)
+
+# -----------------------------------------------------
+# Bulk writes
+# -----------------------------------------------------
+
+def upsert_table(tbl, table, con):
+    """ inserts the rows of tbl into the reflected sqlalchemy table on the connection con,
+    replacing the rows with the same primary key, by LOAD DATA for large tables
+    when local_infile is enabled, or else batched INSERTs
+    """
+    if local_infile() and len(tbl) >= LOAD_DATA_MIN_ROWS:
+        load_data(tbl, table, con)
+    else:
+        insert_on_duplicate(tbl, table, con)
+
+
+def insert_on_duplicate(tbl, table, con, batch_rows=INSERT_BATCH_ROWS):
+    """ multi-row INSERT ... ON DUPLICATE KEY UPDATE of batch_rows rows each
+    """
+    keys = table.primary_key.columns.keys()
+    tbl = as_integers(tbl, table)
+    records = tbl.astype(object).where(tbl.notna(), None).to_dict('records')
+    for i in range(0, len(records), batch_rows):
+        stmt = insert(table).values(records[i:i + batch_rows])
+        stmt = stmt.on_duplicate_key_update(
+            {c: stmt.inserted[c] for c in tbl.columns if not c in keys})
+        con.execute(stmt)
+
+
+def load_data(tbl, table, con):
+    """ writes tbl to a temporary csv and loads it with LOAD DATA LOCAL INFILE,
+    REPLACE swaps in the rows with the same primary key.
+    the client and the server must allow local_infile, see local_infile()
+    """
+    tbl = as_integers(tbl, table)
+    f = tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, newline='')
+    try:
+        tbl.to_csv(f, index=False, header=False, na_rep='NULL', line_terminator='\n')
+        f.close()
+        qry = ("LOAD DATA LOCAL INFILE :path REPLACE INTO TABLE `%s` "
+               "CHARACTER SET utf8mb4 "
+               "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+               "LINES TERMINATED BY '\\n' (%s)") % (
+            table.name, ', '.join('`%s`' % c for c in tbl.columns))
+        con.execute(text(qry), path=f.name.replace('\\', '/'))
+    finally:
+        f.close()
+        os.remove(f.name)
+
+
+def as_integers(tbl, table):
+    """ tbl with the float columns of integer table columns as nullable integers,
+    floats with empty values, such as entry_id, would be written as 123.0
+    """
+    converted = {}
+    for c in tbl.columns:
+        if c in table.columns and isinstance(table.c[c].type, Integer) and tbl[c].dtype.kind == 'f':
+            converted[c] = tbl[c].round().astype('Int64')
+    if len(converted) > 0:
+        tbl = tbl.assign(**converted)
+    return tbl
@@ -3,11 +3,15 @@
 #-----------------------------------------------------
 # Import
 #-----------------------------------------------------
+import time
 import pandas as pd
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 from nthours import database as db
 from nthours.time_series import TimeSeriesTable
+from nthours import time_series
 from nthours import toggl
+from nthours import instrument
 #-----------------------------------------------------
 # Module variables
 #-----------------------------------------------------
@@ -18,12 +22,20 @@ WINDOW_YEARS = 1
 HRS_IN_WEEK = 168
 HRS_IN_DAY = 24
 DELIM = '#'
+BATCH_KEY = 'batch_committed'
+BATCH_CHUNK_DAYS = 30
+STAGING_TABLE = 'event_staging'
+CALENDAR_TABLE = 'calendar'
+ROLLUP_PREFIX = 'rollup_'      # rollup_<period>_<split>, hours per period and split, see activity_report
+STAGING_FIELDS = ['timestamp', 'duration_hrs', 'activity', 'comment', 'entry_id']
 EVENT_FIELDS = ['timestamp', 'date', 'time', 'activity',
-                'duration_hrs', 'year', 'month', 'week', 'DOW', 'comment']
+                'duration_hrs', 'year', 'month', 'week', 'DOW', 'comment', 'entry_id']
+GSHEET_FIELDS = ['date', 'time', 'activity', 'duration_hrs', 'year', 'month', 'week', 'DOW', 'comment']
 MIME_TYPE_CSV = 'text/csv'
 
 #dynamic
 events = None
+activity = None     #TimeSeriesTable of the events in the compact layout, holds the cached rollups
 
 
 #-----------------------------------------------------
@@ -31,88 +43,406 @@ events = None
 #-----------------------------------------------------
 
 
-def load():
-    db.load()
+def load(concurrent=False):
+    if concurrent:
+        # gsheet and gdrive auth run inside the concurrent update
+        db.load_config()
+        db.load_sql()
+    else:
+        db.load()
+    instrument.JSONL_FILE = db.CONFIG.get('instrument_file', '')
+    sync_calendar()
 
 #-----------------------------------------------------
 # Procedures
 #-----------------------------------------------------
 
 
-def update_events(report_date=None):
+def update_events(report_date=None, date_from=None, concurrent=False):
     '''Update events database sqlite and gsheet with new Toggl records
+    if date_from is given, backfills the full range date_from to report_date
+    otherwise syncs only the entries changed since the last sync watermark
+    days that are not yet full wait in the staging table until they are
+    each stage is recorded by the instrument module
+    concurrent runs the independent stages in parallel, see update_events_concurrent
+    '''
+    if concurrent:
+        update_events_concurrent(report_date, date_from)
+    else:
+        with instrument.stage('update_events'):
+            #01 load new events
+            new_events, staged, entry_ids, watermark = fetch_new_events(report_date, date_from)
+
+            #02 push new events to the database, the latest Toggl record wins
+            push_new_events(new_events, staged, entry_ids, watermark)
+
+            #03 load db events
+            with instrument.stage('03 load db events'):
+                has_events = load_events(recent_window_start())
+
+            #06, 07 push recent events to gsheet
+            if has_events:
+                push_recent_events()
+
+
+def update_events_concurrent(report_date=None, date_from=None):
+    '''Update events with the Toggl fetch, the gsheet and gdrive auth and the db load
+    running in parallel, and the gsheet push running while the db write commits
+    the new events are merged into the loaded events in memory for the push
     '''
     global events
 
-    #01 load new events
-    new_events = events_std_format(None, '', report_date)
-    has_new_events = len(new_events) > 0
+    with instrument.stage('update_events'):
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            #01 load new events, 00 gsheet and gdrive auth, 03 load db events
+            fetched = pool.submit(instrument.in_stage(fetch_new_events), report_date, date_from)
+            authorized = pool.submit(instrument.in_stage(load_remote))
+            loaded = pool.submit(instrument.in_stage(load_events_stage))
+            new_events, staged, entry_ids, watermark = fetched.result()
+            has_events = loaded.result()
+            has_new_events = not new_events is None and len(new_events) > 0
+
+            #02 push new events to the database, while the merged events go to gsheet
+            written = pool.submit(instrument.in_stage(push_new_events),
+                                  new_events, staged, entry_ids, watermark)
+            if has_events and len(entry_ids) > 0:
+                # the stored pieces of changed and deleted entries are replaced
+                events = events[~events['entry_id'].isin(entry_ids)]
+            if has_new_events:
+                new_events = new_events[~new_events.index.duplicated(keep='last')]
+                if has_events:
+                    events = pd.concat([events, new_events])
+                    events = events[~events.index.duplicated(keep='last')]
+                    events.sort_index(inplace=True)
+                else:
+                    events = new_events.sort_index()
+                    has_events = True
+
+            #06, 07 push recent events to gsheet
+            authorized.result()
+            if has_events:
+                push_recent_events()
+            written.result()
+
+
+def update_events_range(date_from, date_to, chunk_days=BATCH_CHUNK_DAYS):
+    '''Update events for the range date_from to date_to in chunks of chunk_days,
+    each fetched, standardized and committed before the next, then push to gsheet
+    an interrupted run resumes after the last committed chunk
+    '''
+    progress_key = '%s:%s:%s' % (BATCH_KEY, date_from, date_to)
+
+    with instrument.stage('update_events_range'):
+        committed = db.get_sync_value(progress_key)
+        start = committed if committed else date_from
+        for chunk_from, chunk_to in toggl.date_windows(start, date_to, chunk_days):
+            with instrument.stage('chunk %s to %s' % (chunk_from, chunk_to)):
+                # raises if any window of the chunk failed, so its marker is not advanced
+                new_events, staged, entry_ids = fetch_range_events(chunk_from, chunk_to)
+                push_new_events(new_events, staged, entry_ids, None)
+                db.set_sync_value(progress_key, chunk_to)
+                del new_events
 
-    #02 load db events
-    has_events = load_events()
+        #03 load db events
+        with instrument.stage('03 load db events'):
+            has_events = load_events(recent_window_start())
 
-    if has_new_events:
+        #06, 07 push recent events to gsheet
         if has_events:
-            events = events.append(new_events)
+            push_recent_events()
+
+        db.set_sync_value(progress_key, '')
+
+
+def fetch_new_events(report_date=None, date_from=None):
+    with instrument.stage('01 load new events'):
+        since = None
+        watermark = None
+        entry_ids = []
+        incremental = not (report_date or date_from)
+        if incremental:
+            since = db.get_sync_value(toggl.SINCE_KEY)
+        if since:
+            new_events, staged, entry_ids, watermark = events_since(int(since))
         else:
-            events = new_events.copy()
-            has_events = True
+            sync_time = int(time.time())
+            new_events, staged, entry_ids = events_std_format(None, '', report_date, date_from)
+            if incremental and not new_events is None:
+                watermark = sync_time
+    return new_events, staged, entry_ids, watermark
 
-        # 04 drop duplicates and sort
-        events = events[~events.index.duplicated(keep='first')]
-        events.sort_index(inplace=True)
 
-        # 05 push updates to sqlite
-        db.update_table(events.reset_index()[EVENT_FIELDS],
-                        'event',
-                        False)
+def push_new_events(new_events, staged, entry_ids, watermark):
+    ''' upserts the promoted new events and rewrites the staging table with the
+    events still staged, in one transaction, so that promoted events leave
+    the staging table only once they are in the event table
+    the stored pieces of the Toggl entries entry_ids are deleted first, in the
+    same transaction, so that edited and deleted entries leave no stale pieces
+    '''
+    with instrument.stage('02 push new events to database'):
+        has_new_events = not new_events is None and len(new_events) > 0
+        if has_new_events:
+            new_events = new_events[~new_events.index.duplicated(keep='last')]
+        replaced = db.get_rows('event', 'entry_id', entry_ids, columns=['date'])
+        with db.transaction() as con:
+            db.delete_rows('event', 'entry_id', entry_ids, con=con)
+            if has_new_events:
+                db.upsert_table(new_events.reset_index()[EVENT_FIELDS], 'event', con=con)
+            if not staged is None:
+                db.update_table(staged, STAGING_TABLE, False, con=con)
+        if not activity is None and len(entry_ids) > 0:
+            activity.remove(activity.ts.index[activity.ts['entry_id'].isin(entry_ids)])
+        if has_new_events:
+            push_calendar(new_events.index)
+            if not activity is None:
+                activity.append(new_events.reset_index())
+        touched = [] if replaced is None else list(replaced['date'])
+        if has_new_events:
+            touched += list(new_events.index)
+        refresh_rollups(touched)
 
-    if has_events:
-        # 06 format fields for gsheet
+        if watermark:
+            db.set_sync_value(toggl.SINCE_KEY, watermark)
+
+
+def push_calendar(dateValues):
+    ''' stores the calendar rows of dateValues for sql reports to join on event.date
+    '''
+    records = time_series.calendar_records(dateValues)
+    if db.table_exists(CALENDAR_TABLE) and db.get_columns(CALENDAR_TABLE) != list(records.columns):
+        sync_calendar()
+    else:
+        db.upsert_table(records, CALENDAR_TABLE, key='date')
+
+
+def sync_calendar():
+    ''' backfills the calendar rows of the stored event dates that are missing.
+    the table is rebuilt when the calendar fields changed, see time_series.add_calendarField
+    '''
+    dates = db.get_distinct('event', 'date')
+    if len(dates) == 0:
+        return
+    records = time_series.calendar_records(pd.to_datetime(pd.Series(dates, dtype=object)))
+    if db.get_columns(CALENDAR_TABLE) != list(records.columns):
+        db.update_table(records, CALENDAR_TABLE, False)
+    else:
+        stored = pd.to_datetime(pd.Series(db.get_distinct(CALENDAR_TABLE, 'date'), dtype=object)).dt.date
+        missing = records[~records['date'].isin(stored)]
+        if len(missing) > 0:
+            db.upsert_table(missing, CALENDAR_TABLE, key='date')
+
+
+def push_recent_events():
+    # 06 format fields for gsheet, only for the recent events that are pushed
+    with instrument.stage('06 format fields for gsheet'):
         rngcode = 'events'
+        min_year = events['year'].max() - WINDOW_YEARS + 1
+        recent = events[events['year'] >= min_year].copy()
 
-        # 06.01 date and time to str
+        # 06.01 date and time to str, both from the timestamp index
         date_format = db.GSHEET_CONFIG[rngcode]['date_format']
         time_format = db.GSHEET_CONFIG[rngcode]['time_format']
+        recent['date'] = recent.index.strftime(date_format)
+        recent['time'] = recent.index.strftime(time_format)
 
-        def event_time_convert(time_value):
-            time_str = ''
-            if isinstance(time_value, str):
-                time_str = time_value[:-3]
-            else:
-                time_str = time_value.strftime(time_format)
-            return time_str
+        # 06.02 fill empty str for blank comment fields
+        recent['comment'] = recent['comment'].fillna('')
+        instrument.count(rows=len(recent))
 
-        events['date'] = events['date'].apply(lambda x: dt.datetime.strftime(x, date_format))
-        events['time'] = events['time'].apply(lambda x: event_time_convert(x))
+    #07 push recent events to gsheet
+    with instrument.stage('07 push recent events to gsheet'):
+        db.post_to_gsheet_diff(recent[GSHEET_FIELDS], rngcode, 'USER_ENTERED',
+            keys=recent.index)
 
-        # 06.02 fill empty str for blank comment fields
-        events['comment'].fillna('', inplace=True)
 
-        #07 push recent events to gsheet
-        min_year = events['year'].max() - WINDOW_YEARS + 1
-        recent = events[events['year'] >= min_year].copy()
-        db.post_to_gsheet(recent[
-            [f for f in EVENT_FIELDS if not f == 'timestamp']], rngcode, 'USER_ENTERED')
+def update_activity_report(period='week', split='activity'):
+    '''Push hours per period and activity to the gsheet range activity_<period>
+    '''
+    with instrument.stage('update_activity_report'):
+        with instrument.stage('03 load activity report'):
+            report = activity_report(period, split)
+        if not report is None:
+            rngcode = 'activity_' + period
+            if period == 'day':
+                report = report.copy()
+                report['date'] = report['date'].dt.strftime(db.GSHEET_CONFIG['events']['date_format'])
+            db.post_to_gsheet(report, rngcode, 'USER_ENTERED')
+
+
+def activity_report(period='week', split='activity'):
+    ''' hours per period and activity from all db events
+    the rollups are stored in the table rollup_<period>_<split> on first use, and
+    push_new_events recomputes them only for the periods of new events
+    '''
+    tblname = rollup_table(period, split)
+    if activity is None and db.table_exists(tblname):
+        return db.get_table(tblname)
+    if activity is None:
+        load_activity()
+    if activity is None:
+        return None
+    report = activity.rollup(period, split)
+    if not db.table_exists(tblname):
+        db.update_table(report, tblname, False)
+    return report
+
+
+def rollup_table(period, split):
+    return '%s%s_%s' % (ROLLUP_PREFIX, period, split)
+
+
+def refresh_rollups(dateValues):
+    ''' recomputes the stored rollups for the periods of dateValues from the event table
+    '''
+    tblnames = [t for t in db.table_names if t.startswith(ROLLUP_PREFIX)]
+    if len(dateValues) == 0 or len(tblnames) == 0:
+        return
+    dates = pd.DatetimeIndex(pd.to_datetime(pd.Series(dateValues, dtype=object))).normalize().unique()
+
+    #01 the stored rollups, and the events of every period they share with dates
+    rollups = {}
+    bounds = []
+    for tblname in tblnames:
+        period, split = tblname[len(ROLLUP_PREFIX):].split('_', 1)
+        rollups[(period, split)] = db.get_table(tblname)
+        bounds += list(time_series.period_bounds(dates, period))
+    stored = db.get_table('event', date_from=min(bounds), date_to=max(bounds))
+    table = TimeSeriesTable(stored, dtField='timestamp')
+
+    #02 recompute the periods of dates and store the rollups
+    table.rollups = rollups
+    table.refresh_rollups(TimeSeriesTable(pd.DataFrame({'timestamp': dates}), dtField='timestamp').ts)
+    for period, split in table.rollups:
+        db.update_table(table.rollups[(period, split)], rollup_table(period, split), False)
+
+
+def ingest_csv(filename, chunksize=toggl.CSV_CHUNK_ROWS):
+    '''Load a Toggl detailed-report csv into the events database chunk by chunk
+    '''
+    for std in toggl.std_events_from_csv(filename, chunksize, full_days_only=False):
+        std, staged = promote_full_days(std)
+        chunk_events = TimeSeriesTable(std, dtField='timestamp').ts
+        push_new_events(chunk_events, staged, [], None)
+
+
+def load_remote():
+    with instrument.stage('00 gsheet and gdrive auth'):
+        db.load_gsheet()
+        db.load_gdrive()
+
+
+def load_events_stage():
+    with instrument.stage('03 load db events'):
+        has_events = load_events(recent_window_start())
+    return has_events
 
 
-def load_events():
+def load_events(date_from=None):
+    ''' loads the db events, or only those from date_from on
+    '''
     global events
-    events = db.get_table('event')
+    events = db.get_table('event', date_from=date_from)
     has_events = not events is None
     if has_events:
         events.set_index('timestamp', inplace=True)
+        events.sort_index(inplace=True)
     return has_events
 
 
-def events_std_format(data, filename='', report_date=None):
+def recent_window_start():
+    ''' first date of the events pushed to gsheet, 1 Jan of the year
+    WINDOW_YEARS - 1 before the year of the last event
+    '''
+    last = db.get_max('event', 'date')
+    if last is None or pd.isna(last):
+        return None
+    return dt.date(pd.Timestamp(last).year - WINDOW_YEARS + 1, 1, 1)
+
+
+def load_activity():
+    ''' loads all db events into activity chunk by chunk, in the compact layout
+    only one chunk is held in the layout of the event table at a time
+    '''
+    global activity
+    chunks = []
+    for chunk in db.iter_table('event', order_by='timestamp'):
+        chunk = TimeSeriesTable(chunk, dtField='timestamp').ts
+        if not chunk is None:
+            chunks.append(time_series.compact_events(chunk))
+    if len(chunks) > 0:
+        activity = TimeSeriesTable(None, dtField='timestamp')
+        activity.ts = time_series.concat_compact(chunks)
+
+
+def fetch_range_events(date_from, date_to):
+    ''' create events from the Toggl entries from date_from to date_to
+    raises toggl.TogglAPIError if any window of the range failed
+    '''
+    std = toggl.std_events_from_api_range(date_from, date_to, full_days_only=False)
+    entry_ids = entry_ids_of(std)
+    std, staged = promote_full_days(std, entry_ids)
+    return TimeSeriesTable(std, dtField='timestamp').ts, staged, entry_ids
+
+
+def events_since(since):
+    ''' create events from the Toggl entries changed since the unix timestamp since
+    the entry ids include the deleted entries, which have no events
+    raises toggl.TogglAPIError if the sync request failed
+    '''
+    std, entry_ids, watermark = toggl.std_events_from_api_since(since)
+    try:
+        std, staged = promote_full_days(std, entry_ids)
+        events = TimeSeriesTable(std, dtField='timestamp').ts
+    except:
+        events, staged, entry_ids, watermark = None, None, [], None
+
+    return events, staged, entry_ids, watermark
+
+
+def entry_ids_of(std):
+    ''' the distinct Toggl ids of the standard events, csv events have none
+    '''
+    return [int(i) for i in std['entry_id'].dropna().unique()]
+
+
+def promote_full_days(std, entry_ids=[]):
+    ''' merges standard events with the staged partial days and returns the events
+    on days that are now full, or already in the event table, and the events that
+    stay staged. the caller writes both, see push_new_events
+    staged pieces of the Toggl entries entry_ids are replaced by the pieces in std
+    '''
+    staged = db.get_table(STAGING_TABLE)
+    if not staged is None and len(staged) > 0:
+        staged = staged[~staged['entry_id'].isin(entry_ids)].copy()
+        staged['timestamp'] = pd.to_datetime(staged['timestamp'])
+        staged['date'] = staged['timestamp'].dt.date
+        staged['time'] = staged['timestamp'].dt.time
+        std = pd.concat([staged[toggl.STD_FIELDS], std[toggl.STD_FIELDS]])
+        std = std[~std['timestamp'].duplicated(keep='last')]
+
+    # running hours per date over the staged and new events
+    hbd = std.groupby('date')['duration_hrs'].sum()
+    stored_dates = pd.to_datetime(pd.Series(db.get_distinct('event', 'date'), dtype=object)).dt.date
+    is_full = (hbd > (toggl.HRS_PER_DAY - toggl.DAY_HRS_TOLERANCE)) | hbd.index.isin(stored_dates)
+    is_promoted = std['date'].isin(hbd[is_full].index)
+
+    return std[is_promoted], std[~is_promoted][STAGING_FIELDS]
+
+
+def events_std_format(data, filename='', report_date=None, date_from=None):
     ''' create events from Toggl data table
+    with date_from, raises toggl.TogglAPIError if any window of the range failed
     '''
+    if not report_date:
+        report_date = dt.datetime.today().strftime(toggl.TOGGL_DATE_FORMAT)
+    if date_from:
+        return fetch_range_events(date_from, report_date)
+
     try:
         #01 convert the dates and create activity label
-        if not report_date:
-            report_date = dt.datetime.today().strftime(toggl.TOGGL_DATE_FORMAT)
-        std = toggl.std_events_from_api(report_date)
+        std = toggl.std_events_from_api(report_date, full_days_only=False)
+        entry_ids = entry_ids_of(std)
+        std, staged = promote_full_days(std, entry_ids)
         # std = toggl.standard_form(data)  # deprecated
         # std = nt_standardForm(data)      # deprecated, NowThen method
 
@@ -120,6 +450,6 @@ def events_std_format(data, filename='', report_date=None):
         events = TimeSeriesTable(std, dtField='timestamp').ts
 
     except:
-        events = None
+        events, staged, entry_ids = None, None, []
 
-    return events
+    return events, staged, entry_ids
@@ -3,7 +3,9 @@
 # -----------------------------------------------------
 # Import
 # -----------------------------------------------------
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import datetime as dt
 import math
 
@@ -11,9 +13,145 @@ import math
 # -----------------------------------------------------
 # Module variables
 # -----------------------------------------------------
+#constants
+ACTIVITY_DELIM = '#'
+ROLLUP_PERIODS = {'day':['date'],'week':['year','week'],'month':['year','month'],'year':['year']}
+ROLLUP_SPLITS = {'activity':['activity'],'client':['client'],'project':['client','project']}
+NS_PER_HR = 3600*10**9
+SEC_PER_HR = 3600
+CALENDAR_DTYPES = {'year':'int16','month':'int8','week':'int8','DOW':'int8'}
+CATEGORY_FIELDS = ['activity','comment']
+
+#dynamic
+calendar = None         #memoized calendar dimension indexed by date
+calendarFields = {}     #custom fields name:func, func maps a DatetimeIndex of dates to values
+
 # -----------------------------------------------------
 # Setup
 # -----------------------------------------------------
+# -----------------------------------------------------
+# Calendar dimension
+# -----------------------------------------------------
+
+def get_calendar(dateValues):
+    #calendar rows for the dates of dateValues, extends the memoized calendar with new dates
+    global calendar
+    dates = pd.DatetimeIndex(dateValues).normalize().unique().rename('date')
+    if calendar is None:
+        newDates = dates
+    else:
+        newDates = dates.difference(calendar.index)
+    if len(newDates)>0:
+        newRows = calendar_table(newDates)
+        if calendar is None:
+            calendar = newRows
+        else:
+            calendar = pd.concat([calendar,newRows]).sort_index()
+    return calendar.loc[dates]
+
+def calendar_table(dates):
+    dateValues = pd.Series(dates,index=dates)
+    cal = pd.DataFrame(index=dates)
+    cal['year'] = dateValues.dt.year.astype(CALENDAR_DTYPES['year'])
+    cal['month'] = dateValues.dt.month.astype(CALENDAR_DTYPES['month'])
+    cal['week'] = weekNumbers(dateValues).astype(CALENDAR_DTYPES['week'])
+    cal['DOW'] = dateValues.dt.weekday.astype(CALENDAR_DTYPES['DOW'])
+    for name in calendarFields:
+        cal[name] = calendarFields[name](dates)
+    cal.index.name = 'date'
+    return cal
+
+def add_calendarField(name,func):
+    #custom period field, for example a fiscal period, computed from a DatetimeIndex of dates
+    global calendar
+    calendarFields[name] = func
+    calendar = None
+
+def weekNumbers(dateValues):
+    #columnar get_weekNumber : weeks counted from the monday on or before 1 Jan
+    yearStartDate = dateValues.dt.normalize() - pd.to_timedelta(dateValues.dt.dayofyear-1,unit='D')
+    yearStartDate = yearStartDate - pd.to_timedelta(yearStartDate.dt.weekday,unit='D')
+    return ((dateValues-yearStartDate).dt.days//7+1).astype('int64')
+
+def calendar_records(dateValues):
+    #calendar rows with a date column of datetime.date, to store beside the event table
+    cal = get_calendar(dateValues).reset_index()
+    cal['date'] = cal['date'].dt.date
+    return cal
+
+def period_bounds(dates,period):
+    #first and last date of the periods of the DatetimeIndex dates, a few days wider for weeks
+    first,last = dates.min().normalize(),dates.max().normalize()
+    if period=='week':
+        return first-pd.Timedelta(days=6),last+pd.Timedelta(days=6)
+    elif period=='month':
+        return first.replace(day=1),last+pd.offsets.MonthEnd(0)
+    elif period=='year':
+        return first.replace(month=1,day=1),last.replace(month=12,day=31)
+    return first,last
+
+def period_codes(keys,period):
+    #one integer per period from its key fields, e.g. year*100+week
+    if period=='day':
+        return keys['date'].values.astype('datetime64[D]').astype('int64')
+    codes = np.zeros(len(keys),dtype='int64')
+    for f in ROLLUP_PERIODS[period]:
+        codes = codes*100+keys[f].values.astype('int64')
+    return codes
+
+# -----------------------------------------------------
+# Compact layout
+# -----------------------------------------------------
+
+def compact_events(ts):
+    #events with categorical labels, integer-second durations and small-int calendar fields
+    #the date and time columns are dropped, both are in the datetime64 index
+    compact = pd.DataFrame(index=ts.index)
+    for f in ts.columns:
+        if f in ['date','time']:
+            continue
+        elif f=='duration_hrs':
+            compact['duration_sec'] = np.round(ts[f].values*SEC_PER_HR).astype('int32')
+        elif f in CALENDAR_DTYPES:
+            compact[f] = ts[f].astype(CALENDAR_DTYPES[f])
+        elif f in CATEGORY_FIELDS:
+            compact[f] = ts[f].astype('category')
+        else:
+            compact[f] = ts[f]
+    return compact
+
+def expand_events(compact):
+    #events in the layout of the event table, from compact_events
+    ts = pd.DataFrame(index=compact.index)
+    ts['date'] = compact.index.date
+    ts['time'] = compact.index.time
+    for f in compact.columns:
+        if f=='duration_sec':
+            ts['duration_hrs'] = compact[f].values/SEC_PER_HR
+        elif f in CALENDAR_DTYPES:
+            ts[f] = compact[f].astype('int64')
+        elif f in CATEGORY_FIELDS:
+            ts[f] = compact[f].astype(object)
+        else:
+            ts[f] = compact[f]
+    return ts
+
+def concat_compact(frames):
+    #concat of compact events, the label categories are unioned instead of falling back to object
+    labels = [f for f in CATEGORY_FIELDS if f in frames[0].columns]
+    compact = pd.concat([x.drop(columns=labels) for x in frames])
+    for f in labels:
+        compact[f] = union_categoricals([x[f] for x in frames])
+    return compact[frames[0].columns]
+
+def is_compact(ts):
+    return 'duration_sec' in ts.columns
+
+def duration_hours(ts):
+    if is_compact(ts):
+        return ts['duration_sec'].values/SEC_PER_HR
+    return ts['duration_hrs'].values
+
 # -----------------------------------------------------
 # TimeSeriesTable
 # -----------------------------------------------------
@@ -22,10 +160,14 @@ class TimeSeriesTable():
     data = None
     ts = None
     dtField = ''
+    rollups = None
+    intervals = None
     def __init__(self,data,dtField='datetime'):
+        self.rollups = {}
+        self.intervals = None
+        self.dtField = dtField
         if isinstance(data,pd.DataFrame):
             self.data = data
-            self.dtField = dtField
             if self.is_timeSeries(data)>0:
                 self.ts = self.as_timeSeries(data)
     def is_timeSeries(self,data):
@@ -36,15 +178,16 @@ class TimeSeriesTable():
             cond[2] = isinstance(data.iloc[0][self.dtField],dt.datetime)
         return all(cond)
     def as_timeSeries(self,data):
-        ts = data.copy()
-        ts = self.addFields_ymwk(ts)
+        #shallow copy : the column values are shared with data, not copied
+        ts = self.addFields_ymwk(data.copy(deep=False))
         ts.set_index(self.dtField,inplace=True)
         return ts
     def addFields_ymwk(self,data):
-        data['year'] = data.apply(lambda x:x[self.dtField].year,axis=1)
-        data['month'] = data.apply(lambda x:x[self.dtField].month,axis=1)
-        data['week'] = data.apply(lambda x:self.get_weekNumber(x[self.dtField]),axis=1)
-        data['DOW'] = data.apply(lambda x:x[self.dtField].weekday(),axis=1)
+        #join the calendar dimension on the date of each row
+        dates = pd.to_datetime(data[self.dtField]).dt.normalize()
+        fields = get_calendar(dates).reindex(dates.values)
+        for f in fields.columns:
+            data[f] = fields[f].values
         return data
     def get_weekNumber(self,dateValue):
         yearLng = dateValue.year
@@ -53,6 +196,143 @@ class TimeSeriesTable():
         return weekNumber
     def head(self):
         return self.ts.head()
+    def compact(self):
+        #convert ts to the compact layout, rows appended later are converted too
+        if not self.ts is None and not is_compact(self.ts):
+            self.ts = compact_events(self.ts)
+    def expanded(self):
+        #ts in the layout of the event table
+        if not self.ts is None and is_compact(self.ts):
+            return expand_events(self.ts)
+        return self.ts
+    def append(self,data):
+        #add or replace rows by dtField, and recompute the cached rollups only for the periods touched
+        if not self.is_timeSeries(data):
+            return
+        new = self.as_timeSeries(data).sort_index()
+        if not self.ts is None and is_compact(self.ts):
+            new = compact_events(new)
+        if self.ts is None:
+            self.ts = new
+            self.rollups = {}
+            self.intervals = None
+            return
+        isReplaced = self.ts.index.isin(new.index)
+        isLater = new.index[0]>self.ts.index.max()
+        self.ts = pd.concat([self.ts[~isReplaced],new]).sort_index()
+        for f in CATEGORY_FIELDS:
+            if is_compact(self.ts) and f in self.ts.columns and not self.ts[f].dtype=='category':
+                #new labels, concat of unequal categories falls back to object
+                self.ts[f] = self.ts[f].astype('category')
+        if not self.intervals is None:
+            if isLater and not isReplaced.any():
+                self.extend_intervals(new)
+            else:
+                self.intervals = None
+        self.refresh_rollups(new)
+    def remove(self,keys):
+        #drop the rows at the dtField values keys, and recompute the cached rollups only for the periods touched
+        if self.ts is None:
+            return
+        isRemoved = self.ts.index.isin(keys)
+        if not isRemoved.any():
+            return
+        removed = self.ts[isRemoved]
+        self.ts = self.ts[~isRemoved]
+        self.intervals = None
+        self.refresh_rollups(removed)
+    def refresh_rollups(self,changed):
+        #recompute the cached rollups for the periods of the changed rows from the rows now in ts
+        codes = {}
+        for period,split in self.rollups:
+            if not period in codes:
+                touched = np.unique(period_codes(self.period_keys(changed,period),period))
+                inTouched = None if self.ts is None else \
+                    np.isin(period_codes(self.period_keys(self.ts,period),period),touched)
+                codes[period] = inTouched,touched
+            inTouched,touched = codes[period]
+            cached = self.rollups[(period,split)]
+            kept = cached[~np.isin(period_codes(cached,period),touched)]
+            if self.ts is None:
+                rolled = kept.iloc[:0]
+            else:
+                rolled = self.rollup_hours(self.ts[inTouched],period,split)
+            rollup = pd.concat([kept,rolled]).sort_values(ROLLUP_PERIODS[period]+ROLLUP_SPLITS[split])
+            self.rollups[(period,split)] = rollup.reset_index(drop=True)
+    def rollup(self,period='week',split='activity'):
+        #hours per period (day,week,month,year) and split (activity,client,project), cached
+        if self.ts is None:
+            return None
+        if not (period,split) in self.rollups:
+            self.rollups[(period,split)] = self.rollup_hours(self.ts,period,split)
+        return self.rollups[(period,split)]
+    def rollup_hours(self,ts,period,split,valueField='duration_hrs'):
+        #hours as floats from either layout
+        frame = self.period_keys(ts,period)
+        if split=='activity':
+            frame['activity'] = ts['activity'].values
+        else:
+            #split the Client#Project label once per distinct activity
+            labels = pd.Categorical(ts['activity'].values)
+            parts = pd.Series(labels.categories).str.partition(ACTIVITY_DELIM)
+            frame['client'] = parts[0].values[labels.codes]
+            if split=='project':
+                frame['project'] = parts[2].values[labels.codes]
+        frame[valueField] = duration_hours(ts)
+        groupFields = ROLLUP_PERIODS[period]+ROLLUP_SPLITS[split]
+        hours = frame.groupby(groupFields,observed=True)[valueField].sum().reset_index()
+        if split=='activity':
+            hours['activity'] = hours['activity'].astype(object)
+        return hours.sort_values(groupFields).reset_index(drop=True)
+    def period_keys(self,ts,period):
+        if period=='day':
+            keys = pd.DataFrame({'date':ts.index.normalize()})
+        else:
+            keys = pd.DataFrame({f:ts[f].values for f in ROLLUP_PERIODS[period]})
+        return keys
+    def interval_index(self):
+        #start and end of each row in ts order, with the running max of ends for overlap queries
+        if self.intervals is None and not self.ts is None:
+            if not self.ts.index.is_monotonic_increasing:
+                self.ts = self.ts.sort_index()
+            starts,ends = self.interval_bounds(self.ts)
+            self.intervals = {'start':starts,'end':ends,'maxEnd':np.maximum.accumulate(ends)}
+        return self.intervals
+    def interval_bounds(self,ts):
+        starts = ts.index.values.astype('datetime64[ns]').astype('int64')
+        if is_compact(ts):
+            ends = starts+ts['duration_sec'].values.astype('int64')*(NS_PER_HR//SEC_PER_HR)
+        else:
+            ends = starts+np.round(ts['duration_hrs'].values*NS_PER_HR).astype('int64')
+        return starts,ends
+    def extend_intervals(self,new):
+        #new rows all start after the indexed rows, so the index is extended in place of a rebuild
+        starts,ends = self.interval_bounds(new)
+        maxEnd = np.maximum.accumulate(np.maximum(ends,self.intervals['maxEnd'][-1:]))
+        self.intervals = {'start':np.concatenate([self.intervals['start'],starts]),
+                          'end':np.concatenate([self.intervals['end'],ends]),
+                          'maxEnd':np.concatenate([self.intervals['maxEnd'],maxEnd])}
+    def overlap(self,start,end=None):
+        #rows whose [timestamp, timestamp + duration) overlaps [start,end), or contains start if end is None
+        idx = self.interval_index()
+        if idx is None:
+            return None
+        t0 = pd.Timestamp(start).value
+        t1 = t0 if end is None else pd.Timestamp(end).value
+        lo = np.searchsorted(idx['maxEnd'],t0,side='right')
+        hi = np.searchsorted(idx['start'],t1,side='right' if end is None else 'left')
+        pos = lo+np.flatnonzero(idx['end'][lo:hi]>t0)
+        return self.ts.iloc[pos]
+    def at(self,when):
+        #rows in progress at when
+        return self.overlap(when)
+    def window(self,start,end):
+        #rows starting in [start,end)
+        idx = self.interval_index()
+        if idx is None:
+            return None
+        lo,hi = np.searchsorted(idx['start'],[pd.Timestamp(start).value,pd.Timestamp(end).value])
+        return self.ts.iloc[lo:hi]
 
 # -----------------------------------------------------
 # ****
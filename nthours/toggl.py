@@ -1,11 +1,16 @@
 """this module integrates toggl track events https://github.com/toggl/toggl_api_docs/
 """
+import os
 import json
-import math
+import time
+import hashlib
+import numpy as np
 import pandas as pd
 import datetime as dt
 import requests
 import pytz
+from concurrent.futures import ThreadPoolExecutor
+from nthours import instrument
 
 api = None
 
@@ -18,10 +23,26 @@ DETAILED_REPORT_URL = TOGGL_URL + '/reports/detailed/' + TOGGL_ACCOUNT + '/from/
 HRS_PER_DAY = 24
 SEC_PER_HOUR = 3600
 DAY_HRS_TOLERANCE = 2
+BACKFILL_WINDOW_DAYS = 30
+BACKFILL_MAX_WORKERS = 4
+CSV_CHUNK_ROWS = 50000
+CACHE_MODE = 'off'    # 'record' to save api responses, 'replay' to serve them offline
+CACHE_DIR = 'toggl_cache'
+CACHE_TTL_HRS = 24
+SECRET_FIELDS = ['api_token']    # never written to CACHE_DIR, /me returns the account token
 TOGGL_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S+00:00'
 TOGGL_STOP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 TOGGL_DATE_FORMAT = '%Y-%m-%d'
 TOGGL_TIME_FORMAT = '%H:%M:%S'
+SINCE_KEY = 'toggl_since'
+DIMENSION_CACHE_FILE = 'toggl_dimensions.json'
+DIMENSION_CACHE_TTL_HRS = 24
+MAX_RETRIES = 5
+BACKOFF_BASE_SEC = 1
+BACKOFF_MAX_SEC = 60
+RETRY_STATUS = [429, 500, 502, 503, 504]
+QUOTA_REMAINING_HEADER = 'X-Toggl-Quota-Remaining'
+QUOTA_RESETS_IN_HEADER = 'X-Toggl-Quota-Resets-In'
 ACTIVITY_DELIM = '#'
 TAG_DELIM = ' - '
 STD_FIELDS = [
@@ -30,148 +51,270 @@ STD_FIELDS = [
     'time',
     'duration_hrs',
     'activity',
-    'comment'
+    'comment',
+    'entry_id'
+]
+EXPORT_FIELDS = [
+    'Client',
+    'Project',
+    'Description',
+    'Start date',
+    'Start time',
+    'Duration',
+    'Tags'
 ]
 
-def standard_form(data):
+def standard_form(data, full_days_only=True, copy=True):
     """ converts toggl records from csv to the standard events format
-    fields = [timestamp, date, time (start time), duration_hrs, activity, comment]
+    fields = [timestamp, date, time (start time), duration_hrs, activity, comment, entry_id]
+    the export has no toggl id, so entry_id is empty
     """
-    std = data.copy()
+    std = data.copy() if copy else data
+    std['entry_id'] = np.nan
 
     # 1. Create `activity` = `Client`#`Project` same as NT script
-    std['Client'].fillna('', inplace=True)
-    std['Project'].fillna('', inplace=True)
-    std['activity'] = std.apply(lambda x: x['Client'] + ACTIVITY_DELIM + x['Project'], axis=1)
+    std['activity'] = std['Client'].fillna('') + ACTIVITY_DELIM + std['Project'].fillna('')
 
     # 2. Add the `Tags` as a hyphen delimited prefix to the description `comment` = `Tag` - `Description`
-    std['Tags'].fillna('', inplace=True)
-    std['Description'].fillna('', inplace=True)
-    std['comment'] = std.apply(
-        lambda x: x['Tags'] + TAG_DELIM + x['Description'] if len(x['Tags']) > 0 else x['Description'], axis=1)
+    tags = std['Tags'].fillna('')
+    description = std['Description'].fillna('')
+    std['comment'] = description.where(tags.str.len() == 0, tags + TAG_DELIM + description)
 
-    # 3. Split events that overlap between two days into two events ending and beginning at midnight to enforce 24 hours in a day
-    std = split_overlap_events(std)
+    # 3. Create `timestamp` from `Start date` and `Start time`, and `duration` in integer seconds from `Duration`
+    std['timestamp'] = timestamp_from_export(std['Start date'], std['Start time'])
+    std['duration'] = seconds_from_duration(std['Duration'])
 
-    # 4. Parse the `Start date`, `Start time` strings into datetime objects
-    std['date'] = std['Start date'].apply(lambda x: dt.datetime.strptime(x, TOGGL_DATE_FORMAT).date())
-    std['time'] = std['Start time'].apply(lambda x: dt.datetime.strptime(x, TOGGL_TIME_FORMAT).time())
+    # 4. Split events that overlap midnight into one event per day, ending and beginning at midnight to enforce 24 hours in a day
+    std = split_overlap_events(std, method='api_entries')
 
-    # 5. Create `timestamp` from `date` and `time` same as the NT script
-    std['timestamp'] = std.apply(lambda x: dt.datetime.combine(x['date'], x['time']), axis=1)
+    # 5. add start date and start time
+    std['date'] = std['timestamp'].dt.date
+    std['time'] = std['timestamp'].dt.time
 
-    # 6. Calculate duration_hrs = D[:2] + (D[3:5] + D[6:8]/60])/60 from the string Duration
-    std['duration_hrs'] = std['Duration'].apply(lambda x: hours_from_timestamp(x))
+    # 6. convert duration from seconds to hours
+    std['duration_hrs'] = std['duration'] / SEC_PER_HOUR
 
     std = std[STD_FIELDS]
 
     # 7. drop partial dates
-    hbd = pd.pivot_table(std, index='date', values='duration_hrs', aggfunc='sum').reset_index()
-    full_dates = hbd[hbd.duration_hrs > (HRS_PER_DAY - DAY_HRS_TOLERANCE)]['date'].to_list()
-    keep = std[std['date'].isin(full_dates)]
+    if full_days_only:
+        keep = keep_full_days(std)
+    else:
+        keep = std
 
     return keep
 
 
-def hours_from_timestamp(ts_str):
-    # H:M:S
-    hrs = int(ts_str[:2])+(int(ts_str[3:5])+int(ts_str[6:8])/60)/60
-    return hrs
+def std_events_from_csv(filename, chunksize=CSV_CHUNK_ROWS, full_days_only=True):
+    """ generator of standard events from a detailed-report csv read in chunks
+    the csv must be sorted by start, ascending or descending. events on the last day
+    of a chunk may continue in the next chunk and are carried over until it is read.
+    the order is decided by the first two distinct start dates, until then all
+    events are carried over
+    """
+    pending = None
+    last_date = None
+    ascending = None
+    chunks = pd.read_csv(filename, chunksize=chunksize, usecols=EXPORT_FIELDS, dtype=str)
+    for chunk in chunks:
+        chunk_dates = pd.to_datetime(chunk['Start date'], format=TOGGL_DATE_FORMAT)
+        std = standard_form(chunk, full_days_only=False, copy=False)
+        if not pending is None:
+            std = pd.concat([pending, std])
+
+        # 00 the order of the csv, checked again on every later chunk
+        # last_date is the start date of the last row read
+        if last_date is None:
+            last_date = chunk_dates.iloc[0]
+        if ascending is None and not chunk_dates.iloc[-1] == last_date:
+            ascending = last_date < chunk_dates.iloc[-1]
+        elif ascending is None:
+            pending = std
+            continue
+        if ascending:
+            is_sorted = chunk_dates.is_monotonic_increasing and chunk_dates.iloc[0] >= last_date
+        else:
+            is_sorted = chunk_dates.is_monotonic_decreasing and chunk_dates.iloc[0] <= last_date
+        if not is_sorted:
+            raise ValueError('%s is not sorted by start date' % filename)
+        last_date = chunk_dates.iloc[-1]
+
+        # 01 days before the last start date of the chunk are complete
+        if ascending:
+            settled = std['timestamp'] < chunk_dates.max()
+        else:
+            settled = std['timestamp'] >= chunk_dates.min() + dt.timedelta(days=1)
+        pending = std[~settled]
 
+        yield keep_full_days(std[settled]) if full_days_only else std[settled]
 
-def timestamp_from_hours(hrs):
-    hms = []
-    hms.append(math.floor(hrs))                     # hour
-    hms.append(math.floor((hrs-hms[0])*60))         # min
-    hms.append(round(((hrs-hms[0])*60-hms[1])*60))  # sec
-    timestamp = ':'.join(['%.2d' % x for x in hms])
-    return timestamp
+    if not pending is None:
+        yield keep_full_days(pending) if full_days_only else pending
 
 
-def end_of_day_from_overlap(events):
-    def duration_same_day(start_time):
-        start_hrs = hours_from_timestamp(start_time)
-        same_hrs = 24 - start_hrs
-        same_dur = timestamp_from_hours(same_hrs)
-        return same_dur
+def keep_full_days(std):
+    hbd = std.groupby('date')['duration_hrs'].sum()
+    full_dates = hbd[hbd > (HRS_PER_DAY - DAY_HRS_TOLERANCE)].index
+    keep = std[std['date'].isin(full_dates)]
+    return keep
 
-    def duration_next_day(start_time, ovlp_dur):
-        ovlp_hrs = hours_from_timestamp(ovlp_dur)
-        start_hrs = hours_from_timestamp(start_time)
-        same_hrs = 24 - start_hrs
-        next_hrs = ovlp_hrs - same_hrs
-        next_dur = timestamp_from_hours(next_hrs)
-        return next_dur
 
-    d0 = events.copy()
-    d1 = events.copy()
+def timestamp_from_export(start_dates, start_times):
+    timestamps = pd.to_datetime(start_dates + ' ' + start_times,
+                                format=TOGGL_DATE_FORMAT + ' ' + TOGGL_TIME_FORMAT)
+    return timestamps
 
-    d0['Duration'] = d0['Start time'].apply(lambda x: duration_same_day(x))
-    d1['Duration'] = d1.apply(lambda x: duration_next_day(x['Start time'], x['Duration']), axis=1)
-    d1['Start date'] = d1['End date']
-    d1['Start time'] = '00:00:00'
 
-    eod = pd.concat([d0, d1], axis=0)
-    return eod
+def seconds_from_duration(durations):
+    """ integer seconds from H:M:S duration strings, hours may exceed 24
+    """
+    hms = durations.str.split(':', expand=True).astype('int64')
+    seconds = hms[0] * SEC_PER_HOUR + hms[1] * 60 + hms[2]
+    return seconds
+
+
+def duration_from_seconds(seconds):
+    """ HH:MM:SS duration strings from integer seconds
+    """
+    durations = ((seconds // SEC_PER_HOUR).astype(str).str.zfill(2) + ':'
+                 + (seconds % SEC_PER_HOUR // 60).astype(str).str.zfill(2) + ':'
+                 + (seconds % 60).astype(str).str.zfill(2))
+    return durations
 
 
 def split_overlap_events(events, method='api_entries'):
-    # 01 split the events into overlap and non-overlap
+    """ cuts every event at each local midnight it crosses to enforce 24 hours in a day
+    """
+    # 01 start timestamp and duration in seconds of each event
     if method == 'api_entries':
-        ovlp = events[events['start_date'] != events['stop_date']]
-        non_ovlp = events[events['start_date'] == events['stop_date']]
+        start = events['timestamp']
+        duration_sec = events['duration']
 
     elif method == 'export_detailed':
-        ovlp = events[events['Start date'] != events['End date']]
-        non_ovlp = events[events['Start date'] == events['End date']]
+        start = timestamp_from_export(events['Start date'], events['Start time'])
+        duration_sec = seconds_from_duration(events['Duration'])
 
     else:
         raise ValueError('method: %s, is not recognized' % method)
 
-    if len(ovlp) > 0:
-        # 02 create end of day events from ovlp
-        if method == 'api_entries':
-            eod = eod_from_ovlp_ts_method(ovlp)
+    # 02 split into one piece per calendar day
+    rows, piece_start, piece_sec = split_at_midnight(start, duration_sec)
+    split = events.iloc[rows].copy()
 
-        elif method == 'export_detailed':
-            eod = end_of_day_from_overlap(ovlp)
+    # 03 write the pieces back in the source format
+    if method == 'api_entries':
+        split['timestamp'] = piece_start
+        split['duration'] = piece_sec
 
-        else:
-            raise ValueError('method: %s, is not recognized' % method)
+    elif method == 'export_detailed':
+        piece_start = pd.Series(piece_start, index=split.index)
+        piece_sec = pd.Series(piece_sec, index=split.index)
+        split['Start date'] = piece_start.dt.strftime(TOGGL_DATE_FORMAT)
+        split['Start time'] = piece_start.dt.strftime(TOGGL_TIME_FORMAT)
+        split['Duration'] = duration_from_seconds(piece_sec)
+
+    return split
 
-        # 03 append eod events to the non_ovlp
-        non_ovlp = non_ovlp.append(eod)
 
-    return non_ovlp
+def split_at_midnight(start, duration_sec):
+    """ cuts intervals at every midnight they cross
+    returns the source row position, start timestamp and duration in seconds of each piece
+    """
+    one_day = np.timedelta64(1, 'D')
+    start = pd.to_datetime(pd.Series(start)).values
+    duration = pd.to_timedelta(np.asarray(duration_sec, dtype='int64'), unit='s').values
+    stop = start + duration
+    first_day = start.astype('datetime64[D]').astype(start.dtype)
+
+    # an interval ending exactly at midnight does not start a piece on the next day
+    n_days = np.maximum(np.ceil((stop - first_day) / one_day).astype('int64'), 1)
+    rows = np.repeat(np.arange(len(start)), n_days)
+    day_num = np.arange(len(rows)) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+
+    day_start = first_day[rows] + day_num * one_day
+    piece_start = np.maximum(start[rows], day_start)
+    piece_stop = np.minimum(stop[rows], day_start + one_day)
+    piece_sec = ((piece_stop - piece_start) // np.timedelta64(1, 's')).astype('int64')
+    return rows, piece_start, piece_sec
+
+
+class TogglAPIError(Exception):
+    def __init__(self, route, status_code):
+        super().__init__('toggl api request %s failed with status %s' % (route, status_code))
+        self.route = route
+        self.status_code = status_code
+
+
+def retry_delay(headers, attempt):
+    """ seconds to wait before the next attempt, from the rate-limit headers
+    if the server sent them, otherwise exponential backoff
+    """
+    if 'Retry-After' in headers:
+        delay = float(headers['Retry-After'])
+    elif QUOTA_RESETS_IN_HEADER in headers:
+        delay = float(headers[QUOTA_RESETS_IN_HEADER])
+    else:
+        delay = BACKOFF_BASE_SEC * 2 ** attempt
+    return min(delay, BACKOFF_MAX_SEC)
 
 
 class TogglAPI(object):
     API_TOKEN = ''
     session = None
     auth = None
+    since = None
 
     def __init__(self):
         self.login()
 
     def login(self):
-        with open('api_token') as f:
-            self.API_TOKEN = f.read()
-        f.close()
+        if CACHE_MODE == 'replay' and not os.path.exists('api_token'):
+            self.API_TOKEN = ''
+        else:
+            with open('api_token') as f:
+                self.API_TOKEN = f.read()
+            f.close()
+        if CACHE_MODE == 'record':
+            evict_cached_responses()
 
         self.session = requests.Session()
         self.session.auth = (self.API_TOKEN, 'api_token')
+        # pool sized for the backfill workers sharing this session
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=BACKFILL_MAX_WORKERS)
+        self.session.mount('https://', adapter)
         self.auth, status_code = self.get('/me')
 
     def get(self, route):
+        """ requests the route, retrying on 429, 5xx and connection errors with backoff
+        returns the content, {} unless the status is 200, and the last status code
+        """
+        if CACHE_MODE in ['record', 'replay']:
+            content = cached_response(route)
+            if not content is None:
+                return content, 200
+            if CACHE_MODE == 'replay':
+                return {}, 404
+
         content = {}
-        status_code = 400
-        try:
-            response = self.session.get(TOGGL_API_URL + route)
-            status_code = response.status_code
-            if status_code == 200:
-                content = json.loads(response.content.decode('utf-8'))
-        except:
-            print('something went wrong...')
+        status_code = None
+        for attempt in range(MAX_RETRIES + 1):
+            delay = None
+            try:
+                response = self.session.get(TOGGL_API_URL + route)
+                status_code = response.status_code
+                instrument.count(bytes=len(response.content), api_calls=1)
+                if status_code == 200:
+                    content = json.loads(response.content.decode('utf-8'))
+                    if CACHE_MODE == 'record':
+                        record_response(route, content)
+                elif status_code in RETRY_STATUS:
+                    delay = retry_delay(response.headers, attempt)
+            except requests.RequestException:
+                status_code = None
+                delay = retry_delay({}, attempt)
+            if delay is None or attempt == MAX_RETRIES:
+                break
+            time.sleep(delay)
         return content, status_code
 
     def time_entries(self, start_date, end_date):
@@ -181,14 +324,49 @@ class TogglAPI(object):
             end_date=end_date
         )
         entries, status_code = self.get(route)
+        if status_code != 200:
+            raise TogglAPIError(route, status_code)
         return entries
 
+    def sync_entries(self):
+        """ fetches entries created, modified or deleted since the last sync
+        watermark, a unix timestamp, and advances the watermark on success
+        raises TogglAPIError unless the status is 200
+        """
+        sync_time = int(time.time())
+        route = '/me/time_entries?since={since}'.format(since=self.since)
+        entries, status_code = self.get(route)
+        if status_code != 200:
+            raise TogglAPIError(route, status_code)
+        self.since = sync_time
+        return entries
+
+    def time_entries_range(self, start_date, end_date,
+                           window_days=BACKFILL_WINDOW_DAYS,
+                           max_workers=BACKFILL_MAX_WORKERS):
+        """ fetches entries for an arbitrary date range as concurrent
+        requests over API sized windows, merged and de-duplicated by entry id
+        raises TogglAPIError if any window fails after its retries
+        """
+        windows = date_windows(start_date, end_date, window_days)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            fetch = instrument.in_stage(lambda w: self.time_entries(w[0], w[1]))
+            results = list(pool.map(fetch, windows))
+
+        entries = {}
+        for window_entries in results:
+            for e in window_entries:
+                entries[e['id']] = e
+        return list(entries.values())
+
     def workspace_projects(self):
         route_generic = '/workspaces/{workspace_id}/projects'
         route = route_generic.format(
             workspace_id=self.auth['default_workspace_id']
         )
         projects, status_code = self.get(route)
+        if status_code != 200:
+            raise TogglAPIError(route, status_code)
         return projects
 
     def workspace_clients(self):
@@ -197,9 +375,52 @@ class TogglAPI(object):
             workspace_id=self.auth['default_workspace_id']
         )
         client, status_code = self.get(route)
+        if status_code != 200:
+            raise TogglAPIError(route, status_code)
         return client
 
 
+def cache_path(route):
+    key = hashlib.sha1(route.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, key + '.json')
+
+
+def cached_response(route):
+    """ the recorded content for the route and query, None if there is none
+    or, when recording, if it is older than CACHE_TTL_HRS
+    """
+    content = None
+    path = cache_path(route)
+    if os.path.exists(path):
+        with open(path) as f:
+            cached = json.load(f)
+        is_fresh = time.time() - cached['recorded_at'] <= CACHE_TTL_HRS * SEC_PER_HOUR
+        if is_fresh or CACHE_MODE == 'replay':
+            content = cached['content']
+    return content
+
+
+def record_response(route, content):
+    # exist_ok, the backfill pool threads record concurrently
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if isinstance(content, dict):
+        content = {k: v for k, v in content.items() if not k in SECRET_FIELDS}
+    cached = {'route': route, 'recorded_at': time.time(), 'content': content}
+    with open(cache_path(route), 'w') as f:
+        json.dump(cached, f)
+
+
+def evict_cached_responses():
+    """ removes recorded responses older than CACHE_TTL_HRS
+    """
+    if os.path.exists(CACHE_DIR):
+        expiry = time.time() - CACHE_TTL_HRS * SEC_PER_HOUR
+        for name in os.listdir(CACHE_DIR):
+            path = os.path.join(CACHE_DIR, name)
+            if os.path.getmtime(path) < expiry:
+                os.remove(path)
+
+
 def api_login():
     global api
     if not api:
@@ -212,7 +433,7 @@ def api_logout():
         api = None
 
 
-def std_events_from_api(report_date):
+def std_events_from_api(report_date, full_days_only=True):
     global tz_local
     date_from = (dt.datetime.strptime(report_date, TOGGL_DATE_FORMAT)
                     - dt.timedelta(days=2)
@@ -222,25 +443,127 @@ def std_events_from_api(report_date):
 
     tz_local = pytz.timezone(api.auth['timezone'])
     entries = api.time_entries(date_from, report_date)
-    projects = api.workspace_projects()
-    clients = api.workspace_clients()
-    events = std_events_from_entries(entries, projects, clients)
+    projects, clients = workspace_dimensions(entries)
+    events = std_events_from_entries(entries, projects, clients, full_days_only)
 
     api_logout()
 
     return events
 
 
-def std_events_from_entries(entries, projects, clients):
+def std_events_from_api_range(date_from, date_to, full_days_only=True):
+    global tz_local
+    api_login()
+
+    tz_local = pytz.timezone(api.auth['timezone'])
+    entries = api.time_entries_range(date_from, date_to)
+    projects, clients = workspace_dimensions(entries)
+    events = std_events_from_entries(entries, projects, clients, full_days_only)
+
+    api_logout()
+
+    return events
+
+
+def std_events_from_api_since(since):
+    """ standard events for entries changed since the unix timestamp since,
+    including partial days. returns the events, the ids of every changed entry,
+    deleted ones included, and the advanced watermark
+    """
+    global tz_local
+    api_login()
+
+    tz_local = pytz.timezone(api.auth['timezone'])
+    api.since = since
+    entries = api.sync_entries()
+    entry_ids = [e['id'] for e in entries]
+    # deleted entries are not events
+    entries = [e for e in entries if not e.get('server_deleted_at')]
+    if len(entries) > 0:
+        projects, clients = workspace_dimensions(entries)
+        events = std_events_from_entries(entries, projects, clients,
+                                         full_days_only=False)
+    else:
+        events = pd.DataFrame(columns=STD_FIELDS)
+    since = api.since
+
+    api_logout()
+
+    return events, entry_ids, since
+
+
+def workspace_dimensions(entries=[]):
+    """ projects and clients for the workspace, served from the local cache
+    while it is fresh and knows every project referenced by the entries and their clients
+    raises TogglAPIError if either request fails, the cache is saved only once both succeed
+    """
+    cache = load_dimension_cache()
+    workspace_id = api.auth['default_workspace_id']
+    project_ids = set([str(e['project_id']) for e in entries if e.get('project_id')])
+    client_ids = set([str(cache['projects'][p]['client_id']) for p in project_ids
+                      if p in cache['projects'] and cache['projects'][p].get('client_id')])
+    is_stale = (cache.get('workspace_id') != workspace_id
+                or time.time() - cache.get('fetched_at', 0) > DIMENSION_CACHE_TTL_HRS * SEC_PER_HOUR
+                or not project_ids.issubset(cache['projects'])
+                or not client_ids.issubset(cache['clients']))
+    if is_stale:
+        projects = api.workspace_projects()
+        clients = api.workspace_clients()
+        cache = {
+            'workspace_id': workspace_id,
+            'fetched_at': time.time(),
+            'projects': {str(p['id']): p for p in projects},
+            'clients': {str(c['id']): c for c in clients}
+        }
+        save_dimension_cache(cache)
+    return list(cache['projects'].values()), list(cache['clients'].values())
+
+
+def load_dimension_cache():
+    cache = {'projects': {}, 'clients': {}}
+    try:
+        with open(DIMENSION_CACHE_FILE) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        pass
+    return cache
+
+
+def save_dimension_cache(cache):
+    with open(DIMENSION_CACHE_FILE, 'w') as f:
+        json.dump(cache, f)
+
+
+def date_windows(date_from, date_to, window_days=BACKFILL_WINDOW_DAYS):
+    """ splits the range date_from to date_to into consecutive
+    (start_date, end_date) windows of at most window_days
+    """
+    windows = []
+    start = dt.datetime.strptime(date_from, TOGGL_DATE_FORMAT)
+    end = dt.datetime.strptime(date_to, TOGGL_DATE_FORMAT)
+    while start < end:
+        stop = min(start + dt.timedelta(days=window_days), end)
+        windows.append((start.strftime(TOGGL_DATE_FORMAT), stop.strftime(TOGGL_DATE_FORMAT)))
+        start = stop
+    return windows
+
+
+def std_events_from_entries(entries, projects, clients, full_days_only=True):
+    # running timers have a negative duration, minus the start epoch, and are not events yet
+    entries = [e for e in entries if e['duration'] >= 0]
+    if len(entries) == 0:
+        return pd.DataFrame(columns=STD_FIELDS)
     std = pd.DataFrame.from_records(entries)
+    std['entry_id'] = std['id']
 
     # 01 activity label = Client#Project
+    client_names = {c['id']: c['name'] for c in clients}
     activity_labels = []
     for p in projects:
         rcd = {}
         rcd['id'] = p['id']
         task = p['name']
-        client = [c['name'] for c in clients if c['id'] == p['client_id']][0]
+        client = client_names.get(p['client_id'], '')
         rcd['activity'] = client + ACTIVITY_DELIM + task
         activity_labels.append(rcd)
 
@@ -248,22 +571,20 @@ def std_events_from_entries(entries, projects, clients):
     std = std.merge(activities, left_on='project_id', right_on='id', how='left')
 
     # 02 comment = tag - description
-    std['description'].fillna('', inplace=True)
-    std['comment'] = std.apply(lambda x: x['tags'][0] + TAG_DELIM + x['description']
-        if x['tags'] else x['description'], axis=1)
+    std['description'] = std['description'].fillna('')
+    first_tag = std['tags'].str[0]
+    std['comment'] = std['description'].where(first_tag.isna(), first_tag.fillna('') + TAG_DELIM + std['description'])
 
     # 03 convert start time from utc string to sgp timestamp
-    std['timestamp'] = std['start'].apply(lambda x: utc_str_to_local_datetime(x, 'start'))
-    std['start_date'] = std['timestamp'].apply(lambda x: x.date())
-    std['stop_date'] = std['stop'].apply(lambda x: utc_str_to_local_datetime(x, 'stop').date())
+    std['timestamp'] = utc_series_to_local_datetime(std['start'], 'start')
 
-    # 04 Split events that overlap between two days into two events ending and beginning at midnight
+    # 04 Split events that overlap midnight into one event per day, ending and beginning at midnight
     # to enforce 24 hours in a day
     std = split_overlap_events(std, method='api_entries')
 
     # 05 add start date and start time
-    std['date'] = std['timestamp'].apply(lambda x: x.date())
-    std['time'] = std['timestamp'].apply(lambda x: x.time())
+    std['date'] = std['timestamp'].dt.date
+    std['time'] = std['timestamp'].dt.time
 
     # 06 convert duration from seconds to hours
     std['duration_hrs'] = std['duration'] / SEC_PER_HOUR
@@ -271,62 +592,36 @@ def std_events_from_entries(entries, projects, clients):
     std = std[STD_FIELDS]
 
     # 7. drop partial dates
-    hbd = pd.pivot_table(std, index='date', values='duration_hrs', aggfunc='sum').reset_index()
-    full_dates = hbd[hbd.duration_hrs > (HRS_PER_DAY - DAY_HRS_TOLERANCE)]['date'].to_list()
-    keep = std[std['date'].isin(full_dates)]
+    if full_days_only:
+        keep = keep_full_days(std)
+    else:
+        keep = std
 
     return keep
 
 
-def utc_str_to_local_datetime(utc_str, format_code):
+def toggl_datetime_format(format_code):
     if format_code == 'start':
         datetime_format = TOGGL_TIMESTAMP_FORMAT
     elif format_code == 'stop':
         datetime_format = TOGGL_STOP_FORMAT
     else:
         raise ValueError('unrecognized format code %s' % format_code)
+    return datetime_format
 
+
+def utc_series_to_local_datetime(utc_strs, format_code):
+    """ columnar form of utc_str_to_local_datetime for a Series of utc strings
+    """
+    datetime_format = toggl_datetime_format(format_code)
+    utc_timestamps = pd.to_datetime(utc_strs, format=datetime_format)
+    local_timestamps = utc_timestamps.dt.tz_localize(tz_UTC).dt.tz_convert(tz_local).dt.tz_localize(None)
+    return local_timestamps
+
+
+def utc_str_to_local_datetime(utc_str, format_code):
+    datetime_format = toggl_datetime_format(format_code)
     utc_timestamp = dt.datetime.strptime(utc_str, datetime_format)
     tza = tz_UTC.localize(utc_timestamp)
     local_timestamp = tza.astimezone(tz_local).replace(tzinfo=None)
     return local_timestamp
-
-
-def eod_from_ovlp_ts_method(events):
-    def at_midnight(timestamp):
-        midnight = timestamp.replace(
-            hour=0,
-            minute=0,
-            second=0,
-            microsecond=0
-        )
-        return midnight
-
-    def seconds_from_timestamp(timestamp):
-        seconds = (timestamp - at_midnight(timestamp)).seconds
-        return seconds
-
-    def next_day_midnight(timestamp):
-        next_day = at_midnight(timestamp + dt.timedelta(days=1))
-        return next_day
-
-    def duration_same_day(start_time):
-        start_sec = seconds_from_timestamp(start_time)
-        same_sec = HRS_PER_DAY*SEC_PER_HOUR - start_sec
-        return same_sec
-
-    def duration_next_day(start_time, ovlp_sec):
-        start_sec = seconds_from_timestamp(start_time)
-        same_sec = HRS_PER_DAY*SEC_PER_HOUR - start_sec
-        next_sec = ovlp_sec - same_sec
-        return next_sec
-
-    d0 = events.copy()
-    d1 = events.copy()
-
-    d0['duration'] = d0['timestamp'].apply(lambda x: duration_same_day(x))
-    d1['duration'] = d1.apply(lambda x: duration_next_day(x['timestamp'], x['duration']), axis=1)
-    d1['timestamp'] = d1['timestamp'].apply(lambda x: next_day_midnight(x))
-
-    eod = pd.concat([d0, d1], axis=0)
-    return eod
@@ -0,0 +1,152 @@
+"""asyncio client for the toggl track api https://github.com/toggl/toggl_api_docs/
+with a pooled connector, bounded concurrency and retries with exponential backoff
+"""
+import json
+import asyncio
+import pytz
+import aiohttp
+from nthours import toggl
+from nthours import instrument
+from nthours.toggl import TogglAPIError, retry_delay
+from nthours.toggl import MAX_RETRIES, BACKOFF_BASE_SEC, RETRY_STATUS
+from nthours.toggl import QUOTA_REMAINING_HEADER, QUOTA_RESETS_IN_HEADER
+
+MAX_CONCURRENCY = 4
+CONNECTION_LIMIT = 10
+
+
+class AsyncTogglAPI(object):
+    API_TOKEN = ''
+    session = None
+    auth = None
+
+    def __init__(self, api_url=toggl.TOGGL_API_URL, api_token=None,
+                 max_concurrency=MAX_CONCURRENCY):
+        self.api_url = api_url
+        if api_token is None:
+            with open('api_token') as f:
+                api_token = f.read()
+        self.API_TOKEN = api_token
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+        self.resume_at = 0
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.logout()
+
+    async def login(self):
+        connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            auth=aiohttp.BasicAuth(self.API_TOKEN, 'api_token'))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            self.auth, status_code = await self.get('/me')
+        except:
+            # __aexit__ does not run when __aenter__ raises
+            await self.logout()
+            raise
+
+    async def logout(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def get(self, route):
+        """ requests the route, retrying on 429, 5xx and connection errors
+        raises TogglAPIError once the retries are used up or on any other status
+        """
+        loop = asyncio.get_running_loop()
+        status_code = None
+        for attempt in range(MAX_RETRIES + 1):
+            delay = None
+            async with self.semaphore:
+                # wait out a quota window announced by an earlier response
+                wait = self.resume_at - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    async with self.session.get(self.api_url + route) as response:
+                        status_code = response.status
+                        self.track_quota(response.headers)
+                        if status_code == 200:
+                            body = await response.read()
+                            instrument.count(bytes=len(body), api_calls=1)
+                            return json.loads(body.decode('utf-8')), status_code
+                        instrument.count(api_calls=1)
+                        if status_code in RETRY_STATUS:
+                            delay = retry_delay(response.headers, attempt)
+                except aiohttp.ClientError:
+                    status_code = None
+                    delay = retry_delay({}, attempt)
+            if delay is None or attempt == MAX_RETRIES:
+                break
+            await asyncio.sleep(delay)
+        raise TogglAPIError(route, status_code)
+
+    def track_quota(self, headers):
+        if headers.get(QUOTA_REMAINING_HEADER) == '0':
+            resets_in = float(headers.get(QUOTA_RESETS_IN_HEADER, BACKOFF_BASE_SEC))
+            self.resume_at = asyncio.get_running_loop().time() + resets_in
+
+    async def time_entries(self, start_date, end_date):
+        route_generic = '/me/time_entries?start_date={start_date}&end_date={end_date}'
+        route = route_generic.format(
+            start_date=start_date,
+            end_date=end_date
+        )
+        entries, status_code = await self.get(route)
+        return entries
+
+    async def time_entries_range(self, start_date, end_date,
+                                 window_days=toggl.BACKFILL_WINDOW_DAYS):
+        """ fetches all windows of the range at once, bounded by the semaphore,
+        merged and de-duplicated by entry id
+        """
+        windows = toggl.date_windows(start_date, end_date, window_days)
+        results = await asyncio.gather(*[self.time_entries(w[0], w[1]) for w in windows])
+
+        entries = {}
+        for window_entries in results:
+            for e in window_entries:
+                entries[e['id']] = e
+        return list(entries.values())
+
+    async def workspace_projects(self, workspace_id=None):
+        route_generic = '/workspaces/{workspace_id}/projects'
+        route = route_generic.format(
+            workspace_id=workspace_id or self.auth['default_workspace_id']
+        )
+        projects, status_code = await self.get(route)
+        return projects
+
+    async def workspace_clients(self, workspace_id=None):
+        route_generic = '/workspaces/{workspace_id}/clients'
+        route = route_generic.format(
+            workspace_id=workspace_id or self.auth['default_workspace_id']
+        )
+        clients, status_code = await self.get(route)
+        return clients
+
+
+async def fetch_range(date_from, date_to, api_url=toggl.TOGGL_API_URL, api_token=None):
+    """ time entries, projects and clients for a date range in one concurrent fan out
+    """
+    async with AsyncTogglAPI(api_url, api_token) as api:
+        entries, projects, clients = await asyncio.gather(
+            api.time_entries_range(date_from, date_to),
+            api.workspace_projects(),
+            api.workspace_clients())
+        auth = api.auth
+    return auth, entries, projects, clients
+
+
+def std_events_from_api_range(date_from, date_to):
+    auth, entries, projects, clients = asyncio.run(fetch_range(date_from, date_to))
+    toggl.tz_local = pytz.timezone(auth['timezone'])
+    events = toggl.std_events_from_entries(entries, projects, clients)
+    return events
@@ -20,14 +20,41 @@ from nthours import nowthen as nt
 # -----------------------------------------------------
 
 
-def update_events():
+def update_events(concurrent=False):
     '''Update events database sqlite and gsheet with new NowThen records
     '''
+    nt.load(concurrent)
+    nt.update_events(concurrent=concurrent)
+
+def backfill_events(date_from, date_to=None):
+    '''Rebuild events database sqlite and gsheet from Toggl records in a date range
+    '''
+    nt.load()
+    nt.update_events(report_date=date_to, date_from=date_from)
+
+
+def update_events_range(date_from, date_to, chunk_days=None):
+    '''Update events database sqlite and gsheet from Toggl records in a date range, chunk by chunk
+    '''
+    nt.load()
+    if chunk_days:
+        nt.update_events_range(date_from, date_to, int(chunk_days))
+    else:
+        nt.update_events_range(date_from, date_to)
+
+
+def ingest_csv(filename):
+    '''Load a Toggl detailed-report csv export into the events database
+    '''
     nt.load()
-    nt.update_events()
+    nt.ingest_csv(filename)
 
-def update_activity_report():
-    pass
+
+def update_activity_report(period='week', split='activity'):
+    '''Update gsheet with hours per activity for each day, week, month or year
+    '''
+    nt.load()
+    nt.update_activity_report(period, split)
 
 # -----------------------------------------------------
 # User interface
@@ -45,10 +72,16 @@ def autorun():
     if len(sys.argv) > 1:
         process_name = sys.argv[1]
         if process_name == 'update_events':
-            update_events()
+            update_events('--concurrent' in sys.argv[2:])
             #message_box('update success', 'NowThen records are up-to-date', 1)
+        elif process_name == 'backfill_events':
+            backfill_events(*sys.argv[2:4])
+        elif process_name == 'update_events_range':
+            update_events_range(*sys.argv[2:5])
+        elif process_name == 'ingest_csv':
+            ingest_csv(sys.argv[2])
         elif process_name == 'update_activity_report':
-            update_activity_report()
+            update_activity_report(*sys.argv[2:4])
     else:
         print('no report specified')
 
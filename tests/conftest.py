@@ -0,0 +1,72 @@
+import pytest
+import pandas as pd
+from nthours import database as db
+from nthours import nowthen
+from nthours import time_series
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """ the database module loaded against an empty sqlite file
+    """
+    monkeypatch.setattr(db, 'SQL_DB_NAME', 'sqlite:///%s' % (tmp_path / 'hours.db'))
+    monkeypatch.setattr(db, 'DB_SOURCE', 'local')
+    monkeypatch.setattr(db, 'engine', None)
+    monkeypatch.setattr(nowthen, 'events', None)
+    monkeypatch.setattr(nowthen, 'activity', None)
+    monkeypatch.setattr(time_series, 'calendar', None)
+    db.load_sql()
+    yield db
+    db.engine.dispose()
+
+
+def std_events(starts, hours, activity='Work#Dev', comment='', entry_ids=None):
+    """ standard events starting at each of starts, lasting hours
+    """
+    timestamps = pd.to_datetime(pd.Series(starts))
+    std = pd.DataFrame({'timestamp': timestamps})
+    std['date'] = timestamps.dt.date
+    std['time'] = timestamps.dt.time
+    std['duration_hrs'] = hours
+    std['activity'] = activity
+    std['comment'] = comment
+    std['entry_id'] = float('nan') if entry_ids is None else entry_ids
+    return std
+
+
+def full_day(date, pieces=4, entry_ids=None):
+    """ standard events covering the whole of date
+    """
+    starts = pd.date_range(date, periods=pieces, freq='%dH' % (24 // pieces))
+    return std_events(starts, 24 / pieces, entry_ids=entry_ids)
+
+
+class FakeSheets(object):
+    """ gs_engine stand-in, records the writes and keeps the values of each range
+    """
+    def __init__(self):
+        self.calls = []
+
+    def clear_rangevalues(self, wkbid, rngid):
+        self.calls.append(('clear_rangevalues', rngid))
+
+    def set_rangevalues(self, wkbid, rngid, values, input_option):
+        self.calls.append(('set_rangevalues', rngid, values))
+
+    def set_rangesvalues(self, wkbid, range_values, input_option):
+        self.calls.append(('set_rangesvalues', range_values))
+
+    def clear_rangesvalues(self, wkbid, rngids):
+        self.calls.append(('clear_rangesvalues', rngids))
+
+
+@pytest.fixture
+def sheets(monkeypatch):
+    """ a FakeSheets as gs_engine, with the events range of gsheet_config.json
+    """
+    fake = FakeSheets()
+    monkeypatch.setattr(db, 'gs_engine', fake)
+    monkeypatch.setattr(db, 'GSHEET_CONFIG', {
+        'wkbid': 'wkb',
+        'events': {'data': 'events!A2:I', 'date_format': '%Y-%m-%d', 'time_format': '%H:%M:%S'}})
+    return fake
@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from nthours import database as db
+from conftest import full_day
+
+
+@pytest.fixture
+def sqlite_file(tmp_path, monkeypatch):
+    """ url of an sqlite file that db.load_sql will open, and a plain engine to prepare it
+    """
+    url = 'sqlite:///%s' % (tmp_path / 'hours.db')
+    monkeypatch.setattr(db, 'SQL_DB_NAME', url)
+    monkeypatch.setattr(db, 'DB_SOURCE', 'local')
+    monkeypatch.setattr(db, 'engine', None)
+    plain = create_engine(url)
+    yield plain
+    plain.dispose()
+    if not db.engine is None:
+        db.engine.dispose()
+
+
+def stored_dates(engine):
+    return [r[0] for r in engine.execute('SELECT date FROM event ORDER BY timestamp')]
+
+
+def test_migrate_tables_stores_dates_as_dates(sqlite_file):
+    # an event table written by to_sql, without a key, with datetime64 dates
+    day = full_day('2024-01-01')
+    day['date'] = pd.to_datetime(day['date'])
+    day.to_sql('event', con=sqlite_file, index=False)
+
+    db.load_sql()
+    assert stored_dates(sqlite_file) == ['2024-01-01'] * 4
+    assert len(db.get_table('event', date_from='2024-01-01', date_to='2024-01-01')) == 4
+
+
+def test_managed_writes_store_dates_as_dates(sqlite_file):
+    db.load_sql()
+    day = full_day('2024-01-01')
+    day['date'] = pd.to_datetime(day['date'])
+    db.update_table(day.iloc[:2], 'event')
+    db.upsert_table(day.iloc[2:], 'event')
+    assert stored_dates(sqlite_file) == ['2024-01-01'] * 4
+
+
+def test_load_sql_repairs_timestamp_dates(sqlite_file):
+    db.load_sql()
+    db.update_table(full_day('2024-01-01'), 'event')
+    db.engine.dispose()
+    sqlite_file.execute("UPDATE event SET date = date || ' 00:00:00.000000'")
+
+    db.engine = None
+    db.load_sql()
+    assert stored_dates(sqlite_file) == ['2024-01-01'] * 4
+
+
+def test_get_table_date_to_includes_the_whole_day(sqlite_file):
+    db.load_sql()
+    db.update_table(full_day('2024-01-01'), 'event')
+    db.update_table(full_day('2024-01-02'), 'event')
+    assert len(db.get_table('event', date_to='2024-01-01')) == 4
+    assert len(db.get_table('event', date_to='2024-01-01', date_column='timestamp')) == 4
+    assert len(db.get_table('event', date_from='2024-01-02', date_to='2024-01-02')) == 4
+
+
+def sheet_rows(n, first_key=1):
+    keys = list(range(first_key, first_key + n))
+    return pd.DataFrame({'activity': ['a%d' % k for k in keys], 'hours': [float(k) for k in keys]}), keys
+
+
+def test_post_to_gsheet_diff(sqlite_db, sheets):
+    # 01 no snapshot yet, the whole range is posted
+    rows, keys = sheet_rows(5)
+    db.post_to_gsheet_diff(rows, 'events', keys=keys)
+    assert [c[0] for c in sheets.calls] == ['clear_rangevalues', 'set_rangevalues']
+    assert len(sheets.calls[1][2]) == 5
+
+    # 02 one changed middle row is one block
+    del sheets.calls[:]
+    rows.loc[2, 'hours'] = 9.5
+    db.post_to_gsheet_diff(rows, 'events', keys=keys)
+    assert sheets.calls == [('set_rangesvalues', [('events!A4:I4', [['a3', '9.5']])])]
+
+    # 03 a shorter frame clears the rows after it
+    del sheets.calls[:]
+    db.post_to_gsheet_diff(rows.iloc[:3], 'events', keys=keys[:3])
+    assert sheets.calls == [('clear_rangesvalues', ['events!A5:I6'])]
+
+    # 04 rows aged out at the top shift every row, so the whole range is posted
+    del sheets.calls[:]
+    rows, keys = sheet_rows(3, first_key=2)
+    db.post_to_gsheet_diff(rows, 'events', keys=keys)
+    assert [c[0] for c in sheets.calls] == ['clear_rangevalues', 'set_rangevalues']
+    snapshot = db.get_table(db.GSHEET_SNAPSHOT_PREFIX + 'events')
+    assert snapshot['key'].tolist() == [2, 3, 4]
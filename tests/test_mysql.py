@@ -0,0 +1,84 @@
+import csv
+import pandas as pd
+from sqlalchemy import MetaData
+from sqlalchemy.dialects import mysql as mysql_dialect
+from nthours import database as db
+from nthours import mysql
+
+
+class FakeConnection(object):
+    """ records the statements compiled for mysql, and the csv of each LOAD DATA
+    """
+    def __init__(self):
+        self.statements = []
+        self.loaded = []
+
+    def execute(self, stmt, **params):
+        if 'path' in params:
+            with open(params['path'], newline='') as f:
+                self.loaded.append(f.read())
+        self.statements.append(stmt.compile(dialect=mysql_dialect.dialect()))
+
+
+def events(rows):
+    timestamps = pd.date_range('2024-01-01', periods=rows, freq='H')
+    return pd.DataFrame({'timestamp': timestamps, 'duration_hrs': 1.0,
+                         'activity': 'Work#Dev', 'comment': '', 'entry_id': 123.0})
+
+
+def staging():
+    return db.staging_schema(MetaData())
+
+
+def test_insert_on_duplicate_batches_rows():
+    con = FakeConnection()
+    mysql.insert_on_duplicate(events(2500), staging(), con)
+    rows = [len(s.params) // 5 for s in con.statements]
+    assert rows == [mysql.INSERT_BATCH_ROWS, mysql.INSERT_BATCH_ROWS, 500]
+
+    sql = str(con.statements[0])
+    assert sql.startswith('INSERT INTO event_staging')
+    assert 'ON DUPLICATE KEY UPDATE' in sql
+    assert 'duration_hrs = VALUES(duration_hrs)' in sql
+    assert not 'timestamp = VALUES' in sql
+
+
+def test_insert_on_duplicate_binds_integer_ids_and_nulls():
+    tbl = events(2)
+    tbl.loc[1, 'entry_id'] = float('nan')
+    con = FakeConnection()
+    mysql.insert_on_duplicate(tbl, staging(), con)
+    params = con.statements[0].params
+    assert params['entry_id_m0'] == 123 and isinstance(params['entry_id_m0'], int)
+    assert params['entry_id_m1'] is None
+
+
+def test_upsert_table_loads_data_only_with_local_infile(monkeypatch):
+    monkeypatch.setattr(mysql, 'LOAD_DATA_MIN_ROWS', 10)
+    monkeypatch.setattr(mysql, 'MYSQL_CREDENTIALS', {})
+    con = FakeConnection()
+    mysql.upsert_table(events(10), staging(), con)
+    assert con.loaded == []
+
+    monkeypatch.setattr(mysql, 'MYSQL_CREDENTIALS', {'local_infile': True})
+    mysql.upsert_table(events(10), staging(), con)
+    assert len(con.loaded) == 1
+    assert 'LOAD DATA LOCAL INFILE' in str(con.statements[-1])
+
+
+def test_load_data_csv():
+    tbl = events(3)
+    tbl['comment'] = ['plain', 'with, comma and "quotes"', None]
+    tbl.loc[2, 'entry_id'] = float('nan')
+    con = FakeConnection()
+    mysql.load_data(tbl, staging(), con)
+
+    sql = str(con.statements[0])
+    assert 'REPLACE INTO TABLE `event_staging`' in sql
+    assert '(`timestamp`, `duration_hrs`, `activity`, `comment`, `entry_id`)' in sql
+    lines = con.loaded[0].split('\n')
+    assert lines[-1] == '' and len(lines) == 4
+    assert lines[1] == '2024-01-01 01:00:00,1.0,Work#Dev,"with, comma and ""quotes""",123'
+    assert lines[2].endswith(',NULL,NULL')
+    rows = list(csv.reader(lines[:-1]))
+    assert [r[3] for r in rows] == ['plain', 'with, comma and "quotes"', 'NULL']
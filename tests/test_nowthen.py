@@ -0,0 +1,163 @@
+import pytest
+import pandas as pd
+from nthours import nowthen
+from nthours import toggl
+from nthours import time_series
+from nthours.time_series import TimeSeriesTable
+from conftest import full_day, std_events
+
+
+def test_update_events_range_resumes_after_failed_chunk(sqlite_db, monkeypatch):
+    monkeypatch.setattr(nowthen, 'push_recent_events', lambda: None)
+    fetched = []
+
+    def failing_fetch(date_from, date_to):
+        if date_from == '2024-01-03':
+            raise toggl.TogglAPIError('/me/time_entries', 429)
+        fetched.append(date_from)
+        return TimeSeriesTable(full_day(date_from), dtField='timestamp').ts, None, []
+
+    monkeypatch.setattr(nowthen, 'fetch_range_events', failing_fetch)
+    with pytest.raises(toggl.TogglAPIError):
+        nowthen.update_events_range('2024-01-01', '2024-01-05', chunk_days=2)
+    progress_key = '%s:%s:%s' % (nowthen.BATCH_KEY, '2024-01-01', '2024-01-05')
+    assert sqlite_db.get_sync_value(progress_key) == '2024-01-03'
+
+    def fetch(date_from, date_to):
+        fetched.append(date_from)
+        return TimeSeriesTable(full_day(date_from), dtField='timestamp').ts, None, []
+
+    monkeypatch.setattr(nowthen, 'fetch_range_events', fetch)
+    nowthen.update_events_range('2024-01-01', '2024-01-05', chunk_days=2)
+    assert fetched == ['2024-01-01', '2024-01-03']
+    assert sqlite_db.get_sync_value(progress_key) == ''
+    assert len(sqlite_db.get_table('event')) == 8
+
+
+def test_promoted_events_stay_staged_until_the_event_upsert_commits(sqlite_db, monkeypatch):
+    # the first half of the day is staged by an earlier run
+    day = full_day('2024-01-01')
+    sqlite_db.update_table(day.iloc[:2][nowthen.STAGING_FIELDS], nowthen.STAGING_TABLE, False)
+    std, staged = nowthen.promote_full_days(day.iloc[2:])
+    assert len(std) == 4 and len(staged) == 0
+    new_events = TimeSeriesTable(std, dtField='timestamp').ts
+
+    def failing_update(*args, **kwargs):
+        raise IOError('disk full')
+
+    with monkeypatch.context() as m:
+        m.setattr(sqlite_db, 'update_table', failing_update)
+        with pytest.raises(IOError):
+            nowthen.push_new_events(new_events, staged, [], None)
+
+    assert len(sqlite_db.get_table(nowthen.STAGING_TABLE)) == 2
+    assert not sqlite_db.table_exists('event')
+
+    nowthen.push_new_events(new_events, staged, [], None)
+    assert len(sqlite_db.get_table(nowthen.STAGING_TABLE)) == 0
+    assert len(sqlite_db.get_table('event')) == 4
+
+
+def test_sync_replaces_the_pieces_of_edited_and_deleted_entries(sqlite_db):
+    day = full_day('2024-01-01', entry_ids=[1, 2, 3, 4])
+    std, staged = nowthen.promote_full_days(day)
+    nowthen.push_new_events(TimeSeriesTable(std, dtField='timestamp').ts, staged, [1, 2, 3, 4], None)
+    nowthen.load_activity()
+    assert nowthen.activity_report('day')['duration_hrs'].tolist() == [24]
+
+    # entry 2 now starts an hour later, entry 3 is deleted
+    edited = std_events(['2024-01-01 07:00'], 5, entry_ids=[2])
+    std, staged = nowthen.promote_full_days(edited, [2, 3])
+    nowthen.push_new_events(TimeSeriesTable(std, dtField='timestamp').ts, staged, [2, 3], None)
+
+    stored = sqlite_db.get_table('event')
+    assert sorted(stored['entry_id'].tolist()) == [1, 2, 4]
+    assert str(stored.loc[stored['entry_id'] == 2, 'timestamp'].iloc[0]) == '2024-01-01 07:00:00'
+    assert nowthen.activity_report('day')['duration_hrs'].tolist() == [17]
+
+
+def test_calendar_is_backfilled_and_rebuilt_when_a_field_is_added(sqlite_db, monkeypatch):
+    monkeypatch.setattr(time_series, 'calendarFields', {})
+    events = TimeSeriesTable(pd.concat([full_day('2024-01-01'), full_day('2024-01-02')]),
+                             dtField='timestamp').ts
+    sqlite_db.upsert_table(events.reset_index()[nowthen.EVENT_FIELDS], 'event')
+    nowthen.push_calendar(events.index[:4])
+
+    # the calendar of a database written before the calendar table existed is backfilled
+    nowthen.sync_calendar()
+    assert len(sqlite_db.get_table(nowthen.CALENDAR_TABLE)) == 2
+
+    time_series.add_calendarField('fiscal_year', lambda dates: (dates + pd.DateOffset(months=6)).year)
+    nowthen.push_calendar(full_day('2024-07-01')['timestamp'])
+    calendar = sqlite_db.get_table(nowthen.CALENDAR_TABLE)
+    assert len(calendar) == 2
+    assert calendar['fiscal_year'].tolist() == [2024, 2024]
+
+
+def test_update_events_concurrent(sqlite_db, sheets, monkeypatch):
+    stored = TimeSeriesTable(full_day('2024-01-01', entry_ids=[1, 2, 3, 4]), dtField='timestamp').ts
+    sqlite_db.upsert_table(stored.reset_index()[nowthen.EVENT_FIELDS], 'event')
+    new_events = TimeSeriesTable(full_day('2024-01-02', entry_ids=[5, 6, 7, 8]), dtField='timestamp').ts
+    monkeypatch.setattr(nowthen, 'fetch_new_events', lambda *args: (new_events, None, [5, 6, 7, 8], 1704200000))
+    monkeypatch.setattr(nowthen, 'load_remote', lambda: None)
+
+    nowthen.update_events(concurrent=True)
+
+    assert len(sqlite_db.get_table('event')) == 8
+    assert sqlite_db.get_sync_value(toggl.SINCE_KEY) == '1704200000'
+    assert sheets.calls[-1][0] == 'set_rangevalues' and len(sheets.calls[-1][2]) == 8
+    assert len(sqlite_db.get_table(sqlite_db.GSHEET_SNAPSHOT_PREFIX + 'events')) == 8
+
+
+def test_backfill_raises_on_failed_window(sqlite_db, monkeypatch):
+    def failing_range(date_from, date_to, full_days_only=True):
+        raise toggl.TogglAPIError('/me/time_entries', 503)
+
+    monkeypatch.setattr(toggl, 'std_events_from_api_range', failing_range)
+    with pytest.raises(toggl.TogglAPIError):
+        nowthen.update_events(report_date='2024-02-01', date_from='2024-01-01')
+    assert not sqlite_db.table_exists('event')
+
+
+def test_stored_rollups_are_refreshed_for_the_periods_of_new_events(sqlite_db, monkeypatch):
+    def push(std, entry_ids):
+        std, staged = nowthen.promote_full_days(std, entry_ids)
+        nowthen.push_new_events(TimeSeriesTable(std, dtField='timestamp').ts, staged, entry_ids, None)
+
+    push(pd.concat([full_day('2024-01-01', entry_ids=[1, 2, 3, 4]),
+                    full_day('2024-02-05', entry_ids=[5, 6, 7, 8])]), [1, 2, 3, 4, 5, 6, 7, 8])
+    for period in ['day', 'week', 'month']:
+        nowthen.activity_report(period)
+
+    # a later run reads the stored rollups, recomputed only for the periods of new events
+    monkeypatch.setattr(nowthen, 'activity', None)
+    push(std_events(['2024-01-02 00:00', '2024-01-01 06:00'], [24, 3], 'Home#Rest', entry_ids=[9, 2]),
+         [9, 2, 7])
+
+    def fail():
+        raise AssertionError('the rollups are stored')
+
+    with monkeypatch.context() as m:
+        m.setattr(nowthen, 'load_activity', fail)
+        stored = {period: nowthen.activity_report(period) for period in ['day', 'week', 'month']}
+
+    nowthen.load_activity()
+    for period in ['day', 'week', 'month']:
+        pd.testing.assert_frame_equal(stored[period], nowthen.activity.rollup(period), check_dtype=False)
+    assert stored['month']['duration_hrs'].tolist() == [27, 18, 18]
+
+
+def test_update_events_raises_on_failed_sync(sqlite_db, monkeypatch):
+    sqlite_db.set_sync_value(toggl.SINCE_KEY, 100)
+
+    def failing_since(since):
+        raise toggl.TogglAPIError('/me/time_entries?since=100', 503)
+
+    def push_recent_events():
+        raise AssertionError('nothing is pushed after a failed sync')
+
+    monkeypatch.setattr(toggl, 'std_events_from_api_since', failing_since)
+    monkeypatch.setattr(nowthen, 'push_recent_events', push_recent_events)
+    with pytest.raises(toggl.TogglAPIError):
+        nowthen.update_events()
+    assert sqlite_db.get_sync_value(toggl.SINCE_KEY) == '100'
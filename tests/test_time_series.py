@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from nthours import time_series
+from nthours.time_series import TimeSeriesTable
+
+
+def rowwise_fields(timestamps):
+    """ year, month, week and DOW per row, the way addFields_ymwk computed them with apply
+    """
+    ts = TimeSeriesTable(None, dtField='timestamp')
+    return pd.DataFrame({
+        'year': [t.year for t in timestamps],
+        'month': [t.month for t in timestamps],
+        'week': [ts.get_weekNumber(t) for t in timestamps],
+        'DOW': [t.weekday() for t in timestamps]})
+
+
+def test_weekNumbers_matches_get_weekNumber():
+    # every day of 32 years, through leap years and years starting on each weekday
+    dates = pd.Series(pd.date_range('1999-01-01', '2030-12-31', freq='D'))
+    expected = rowwise_fields(dates.dt.to_pydatetime())['week']
+    assert time_series.weekNumbers(dates).tolist() == expected.tolist()
+
+
+def test_addFields_ymwk_matches_rowwise_fields(monkeypatch):
+    monkeypatch.setattr(time_series, 'calendar', None)
+    rng = np.random.default_rng(0)
+    seconds = rng.integers(0, 12 * 365 * 86400, 5000)
+    timestamps = pd.Timestamp('2019-12-25 23:59:59') + pd.to_timedelta(np.sort(seconds), unit='s')
+    data = pd.DataFrame({'timestamp': timestamps, 'duration_hrs': 1.0})
+
+    ts = TimeSeriesTable(data, dtField='timestamp').ts
+    expected = rowwise_fields(timestamps.to_pydatetime())
+    for f in ['year', 'month', 'week', 'DOW']:
+        assert ts[f].astype('int64').tolist() == expected[f].tolist()
@@ -0,0 +1,192 @@
+import json
+import pytest
+import pandas as pd
+from nthours import toggl
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content=None, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(content if content is not None else {}).encode('utf-8')
+        self.headers = headers or {}
+
+
+class FakeSession(object):
+    """ serves scripted responses per route, the last one repeats
+    """
+    def __init__(self, script):
+        self.script = script
+        self.calls = []
+
+    def get(self, url):
+        route = url[len(toggl.TOGGL_API_URL):]
+        self.calls.append(route)
+        responses = self.script[route]
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+def fake_api(script):
+    api = toggl.TogglAPI.__new__(toggl.TogglAPI)
+    api.session = FakeSession(script)
+    return api
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(toggl.time, 'sleep', slept.append)
+    return slept
+
+
+def entries_route(start_date, end_date):
+    return '/me/time_entries?start_date=%s&end_date=%s' % (start_date, end_date)
+
+
+def test_get_retries_429_with_retry_after(sleeps):
+    api = fake_api({'/me': [FakeResponse(429, headers={'Retry-After': '3'}),
+                            FakeResponse(503),
+                            FakeResponse(200, {'id': 1})]})
+    content, status_code = api.get('/me')
+    assert (content, status_code) == ({'id': 1}, 200)
+    assert sleeps == [3.0, toggl.BACKOFF_BASE_SEC * 2]
+
+
+def test_get_gives_up_after_max_retries(sleeps):
+    api = fake_api({'/me': [FakeResponse(500)]})
+    content, status_code = api.get('/me')
+    assert (content, status_code) == ({}, 500)
+    assert len(api.session.calls) == toggl.MAX_RETRIES + 1
+
+
+def test_get_does_not_retry_client_errors(sleeps):
+    api = fake_api({'/me': [FakeResponse(403)]})
+    assert api.get('/me') == ({}, 403)
+    assert sleeps == []
+
+
+def test_time_entries_range_raises_on_failed_window(sleeps):
+    windows = toggl.date_windows('2024-01-01', '2024-03-01', 30)
+    script = {entries_route(*w): [FakeResponse(200, [{'id': i}])] for i, w in enumerate(windows)}
+    script[entries_route(*windows[1])] = [FakeResponse(429)]
+    api = fake_api(script)
+    with pytest.raises(toggl.TogglAPIError):
+        api.time_entries_range('2024-01-01', '2024-03-01', window_days=30)
+
+
+def test_time_entries_range_merges_retried_windows(sleeps):
+    windows = toggl.date_windows('2024-01-01', '2024-03-01', 30)
+    script = {entries_route(*w): [FakeResponse(200, [{'id': i}])] for i, w in enumerate(windows)}
+    script[entries_route(*windows[1])] = [FakeResponse(502), FakeResponse(200, [{'id': 1}, {'id': 9}])]
+    api = fake_api(script)
+    entries = api.time_entries_range('2024-01-01', '2024-03-01', window_days=30)
+    assert sorted(e['id'] for e in entries) == [0, 1, 9]
+
+
+def entry(entry_id, start, duration, project_id=10):
+    return {'id': entry_id, 'project_id': project_id, 'description': 'd%d' % entry_id,
+            'tags': [], 'start': start, 'duration': duration}
+
+
+@pytest.fixture
+def utc(monkeypatch):
+    monkeypatch.setattr(toggl, 'tz_local', toggl.tz_UTC)
+
+
+PROJECTS = [{'id': 10, 'name': 'Dev', 'client_id': 20}]
+CLIENTS = [{'id': 20, 'name': 'Work'}]
+
+
+def test_std_events_from_entries_drops_running_timers(utc):
+    entries = [entry(1, '2024-01-01T22:00:00+00:00', 7200),
+               entry(2, '2024-01-02T09:00:00+00:00', -1704186000)]
+    std = toggl.std_events_from_entries(entries, PROJECTS, CLIENTS, full_days_only=False)
+    assert list(std['duration_hrs']) == [2.0]
+    assert list(std['activity']) == ['Work#Dev']
+
+
+def test_std_events_from_entries_only_running_timers(utc):
+    entries = [entry(2, '2024-01-02T09:00:00+00:00', -1704186000)]
+    std = toggl.std_events_from_entries(entries, PROJECTS, CLIENTS, full_days_only=False)
+    assert len(std) == 0
+    assert list(std.columns) == toggl.STD_FIELDS
+
+
+def export_csv(path, dates, pieces=4):
+    """ a detailed-report csv of full days, rows in the order of dates
+    """
+    rows = ['Client,Project,Description,Start date,Start time,Duration,Tags']
+    for d in dates:
+        for i in range(pieces):
+            rows.append('Work,Dev,,%s,%02d:00:00,%02d:00:00,' % (d, i * 24 // pieces, 24 // pieces))
+    path.write_text('\n'.join(rows) + '\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('dates', [
+    ['2024-01-01', '2024-01-02', '2024-01-03'],
+    ['2024-01-03', '2024-01-02', '2024-01-01']])
+def test_std_events_from_csv_order_from_two_distinct_dates(tmp_path, dates):
+    # the first chunk holds a single date, so the order is decided on the second
+    filename = export_csv(tmp_path / 'export.csv', dates)
+    chunks = list(toggl.std_events_from_csv(filename, chunksize=2))
+    # each day is yielded once it is complete, not carried to the end of the file
+    assert [len(c) for c in chunks if len(c) > 0] == [4, 4, 4]
+    events = pd.concat(chunks)
+    assert events.groupby('date')['duration_hrs'].sum().tolist() == [24, 24, 24]
+
+
+def test_std_events_from_csv_raises_on_unsorted_rows(tmp_path):
+    filename = export_csv(tmp_path / 'export.csv', ['2024-01-01', '2024-01-03', '2024-01-02'])
+    with pytest.raises(ValueError):
+        list(toggl.std_events_from_csv(filename, chunksize=2))
+
+
+@pytest.fixture
+def dimension_api(tmp_path, monkeypatch):
+    """ installs a fake api for workspace 1 and a dimension cache file under tmp_path
+    """
+    monkeypatch.setattr(toggl, 'DIMENSION_CACHE_FILE', str(tmp_path / 'dimensions.json'))
+
+    def install(script):
+        api = fake_api(script)
+        api.auth = {'default_workspace_id': 1}
+        monkeypatch.setattr(toggl, 'api', api)
+        return api
+    return install
+
+
+def test_workspace_dimensions_raises_and_keeps_no_partial_cache(dimension_api, sleeps):
+    dimension_api({'/workspaces/1/projects': [FakeResponse(200, PROJECTS)],
+                   '/workspaces/1/clients': [FakeResponse(403)]})
+    with pytest.raises(toggl.TogglAPIError):
+        toggl.workspace_dimensions([entry(1, '2024-01-01T00:00:00+00:00', 60)])
+    assert toggl.load_dimension_cache() == {'projects': {}, 'clients': {}}
+
+
+def test_workspace_dimensions_refetches_missing_clients(dimension_api, sleeps):
+    toggl.save_dimension_cache({'workspace_id': 1, 'fetched_at': toggl.time.time(),
+                                'projects': {'10': PROJECTS[0]}, 'clients': {}})
+    api = dimension_api({'/workspaces/1/projects': [FakeResponse(200, PROJECTS)],
+                         '/workspaces/1/clients': [FakeResponse(200, CLIENTS)]})
+    projects, clients = toggl.workspace_dimensions([entry(1, '2024-01-01T00:00:00+00:00', 60)])
+    assert clients == CLIENTS
+    assert api.session.calls == ['/workspaces/1/projects', '/workspaces/1/clients']
+
+
+def test_record_mode_strips_the_api_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(toggl, 'CACHE_MODE', 'record')
+    monkeypatch.setattr(toggl, 'CACHE_DIR', str(tmp_path / 'toggl_cache'))
+    api = fake_api({'/me': [FakeResponse(200, {'id': 1, 'api_token': 'secret', 'timezone': 'UTC'})]})
+    content, status_code = api.get('/me')
+    assert content['api_token'] == 'secret'
+    recorded = ''.join(path.read_text() for path in (tmp_path / 'toggl_cache').iterdir())
+    assert not 'secret' in recorded
+    assert toggl.cached_response('/me') == {'id': 1, 'timezone': 'UTC'}
+
+
+def test_sync_entries_raises_and_keeps_the_watermark(sleeps):
+    api = fake_api({'/me/time_entries?since=100': [FakeResponse(403)]})
+    api.since = 100
+    with pytest.raises(toggl.TogglAPIError):
+        api.sync_entries()
+    assert api.since == 100
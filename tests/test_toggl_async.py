@@ -0,0 +1,107 @@
+import json
+import asyncio
+import pytest
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from nthours import toggl
+from nthours import toggl_async
+
+ME = {'default_workspace_id': 1, 'timezone': 'UTC'}
+ENTRIES = [{'id': 1, 'project_id': 10, 'description': '', 'tags': [],
+            'start': '2024-01-01T00:00:00+00:00', 'duration': 3600}]
+
+
+class StandInServer(object):
+    """ a local toggl api serving scripted (status, headers, body) responses per path,
+    the last one repeats. records the loop time of each request per path
+    """
+    def __init__(self, script):
+        self.script = script
+        self.requests = {}
+
+    async def handle(self, request):
+        path = request.path[len('/api/v9'):]
+        self.requests.setdefault(path, []).append(asyncio.get_running_loop().time())
+        responses = self.script[path]
+        status, headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        return web.Response(status=status, headers=headers, text=json.dumps(body))
+
+    def gaps(self, path):
+        times = self.requests[path]
+        return [b - a for a, b in zip(times, times[1:])]
+
+
+def run_against(script, coro):
+    """ runs coro(api) with an AsyncTogglAPI logged in to a stand-in server of script
+    """
+    server = StandInServer(dict({'/me': [(200, {}, ME)]}, **script))
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', server.handle)
+        async with TestServer(app) as test_server:
+            api_url = str(test_server.make_url('/api/v9'))
+            async with toggl_async.AsyncTogglAPI(api_url, api_token='token') as api:
+                return await coro(api)
+
+    return server, asyncio.run(main())
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(toggl, 'BACKOFF_BASE_SEC', 0.05)
+
+
+def test_429_waits_retry_after(fast_backoff):
+    script = {'/me/time_entries': [(429, {'Retry-After': '0.2'}, {}), (200, {}, ENTRIES)]}
+    server, entries = run_against(script, lambda api: api.time_entries('2024-01-01', '2024-01-02'))
+    assert entries == ENTRIES
+    assert len(server.requests['/me/time_entries']) == 2
+    assert server.gaps('/me/time_entries')[0] >= 0.2
+
+
+def test_5xx_backs_off_exponentially(fast_backoff):
+    script = {'/me/time_entries': [(503, {}, {}), (502, {}, {}), (200, {}, ENTRIES)]}
+    server, entries = run_against(script, lambda api: api.time_entries('2024-01-01', '2024-01-02'))
+    assert entries == ENTRIES
+    first, second = server.gaps('/me/time_entries')
+    assert first >= 0.05 and second >= 0.1
+
+
+def test_5xx_raises_once_retries_are_used_up(fast_backoff, monkeypatch):
+    monkeypatch.setattr(toggl_async, 'MAX_RETRIES', 2)
+    script = {'/me/time_entries': [(500, {}, {})]}
+    with pytest.raises(toggl.TogglAPIError) as error:
+        run_against(script, lambda api: api.time_entries('2024-01-01', '2024-01-02'))
+    assert error.value.status_code == 500
+
+
+def test_waits_for_the_quota_reset(fast_backoff):
+    # the projects response uses up the quota, the clients request waits for its reset
+    quota = {toggl.QUOTA_REMAINING_HEADER: '0', toggl.QUOTA_RESETS_IN_HEADER: '0.3'}
+    script = {'/workspaces/1/projects': [(200, quota, [])],
+              '/workspaces/1/clients': [(200, {}, [])]}
+
+    async def projects_then_clients(api):
+        await api.workspace_projects()
+        return await api.workspace_clients()
+
+    server, clients = run_against(script, projects_then_clients)
+    assert clients == []
+    waited = server.requests['/workspaces/1/clients'][0] - server.requests['/workspaces/1/projects'][0]
+    assert waited >= 0.3
+
+
+def test_failed_login_closes_the_session(fast_backoff, monkeypatch):
+    sessions = []
+
+    class RecordedSession(aiohttp.ClientSession):
+        def __init__(self, *args, **kwargs):
+            super(RecordedSession, self).__init__(*args, **kwargs)
+            sessions.append(self)
+
+    monkeypatch.setattr(toggl_async.aiohttp, 'ClientSession', RecordedSession)
+    with pytest.raises(toggl.TogglAPIError):
+        run_against({'/me': [(403, {}, {})]}, lambda api: api.time_entries('2024-01-01', '2024-01-02'))
+    assert len(sessions) == 1 and sessions[0].closed